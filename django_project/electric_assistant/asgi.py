@@ -0,0 +1,23 @@
+"""
+ASGI config for electric_assistant project.
+
+Con un servidor ASGI (uvicorn, daphne) las vistas async como
+extract_bill no ocupan un worker mientras esperan a OpenAI, y
+results_stream entrega cada evento en cuanto se genera.
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'electric_assistant.settings')
+
+application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402  (después del setup)
+
+if settings.DEBUG:
+    # Igual que runserver: sirve /static/ en desarrollo
+    from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
+
+    application = ASGIStaticFilesHandler(application)
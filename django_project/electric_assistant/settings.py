@@ -2,6 +2,7 @@
 Django settings for electric_assistant project.
 """
 
+import tempfile
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -53,6 +54,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'electric_assistant.wsgi.application'
+ASGI_APPLICATION = 'electric_assistant.asgi.application'
 
 DATABASES = {
     'default': {
@@ -61,8 +63,23 @@ DATABASES = {
     }
 }
 
+# Cache compartida entre procesos: las señales que invalidan demos,
+# resultados e historial corren en el proceso que guarda el modelo
+# (seed_demo, recompute_recommendations, shell), no en el servidor.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': Path(tempfile.gettempdir()) / 'electric_assistant_cache',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    }
+}
+
 AUTH_PASSWORD_VALIDATORS = []
 
+# La sesión solo guarda bill_history (≤5 ids): va firmada en la cookie y
+# crear un recibo no escribe en django_session
+SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+
 LANGUAGE_CODE = 'es-mx'
 TIME_ZONE = 'America/Mexico_City'
 USE_I18N = True
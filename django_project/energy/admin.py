@@ -3,36 +3,43 @@ Admin configuration for Energy app.
 """
 
 from django.contrib import admin
+from django.contrib.admin import DateFieldListFilter
+from django.db.models.fields.json import KeyTextTransform
 from .models import Bill, Survey, AnalysisResult
 
 
 @admin.register(Bill)
 class BillAdmin(admin.ModelAdmin):
     list_display = ['id', 'tarifa', 'consumo_kwh', 'periodo_inicio', 'periodo_fin', 'is_demo', 'created_at']
-    list_filter = ['tarifa', 'is_demo', 'created_at']
+    list_filter = ['tarifa', 'is_demo', ('created_at', DateFieldListFilter)]
     search_fields = ['tarifa']
+    show_full_result_count = False
     ordering = ['-created_at']
 
 
 @admin.register(Survey)
 class SurveyAdmin(admin.ModelAdmin):
     list_display = ['id', 'bill', 'created_at', 'resumen_respuestas']
+    list_select_related = ['bill']
+    show_full_result_count = False
     ordering = ['-created_at']
 
+    def get_queryset(self, request):
+        # Extrae en SQL solo las claves del resumen; el JSON completo no se carga.
+        return super().get_queryset(request).defer('respuestas').annotate(
+            resumen_refri=KeyTextTransform('refrigeradores', 'respuestas'),
+            resumen_agua=KeyTextTransform('agua_caliente_tipo', 'respuestas'),
+            resumen_secadora=KeyTextTransform('tiene_secadora', 'respuestas'),
+        )
+
     def resumen_respuestas(self, obj):
         """Muestra un resumen rápido de las respuestas clave."""
-        r = obj.respuestas
-        partes = []
-        # A/C
-        ac = r.get('tiene_ac', 'no')
-        partes.append(f"A/C: {ac}")
-        # Refrigeradores
-        partes.append(f"Refri: {r.get('refrigeradores', '?')}")
-        # Agua caliente
-        partes.append(f"Agua: {r.get('agua_caliente_tipo', '?')}")
-        # Secadora
-        partes.append(f"Secadora: {r.get('tiene_secadora', 'no')}")
-        return " | ".join(partes)
+        return (
+            f"A/C: {obj.tiene_ac or 'no'} | "
+            f"Refri: {obj.resumen_refri or '?'} | "
+            f"Agua: {obj.resumen_agua or '?'} | "
+            f"Secadora: {obj.resumen_secadora or 'no'}"
+        )
 
     resumen_respuestas.short_description = "Resumen"
 
@@ -40,4 +47,10 @@ class SurveyAdmin(admin.ModelAdmin):
 @admin.register(AnalysisResult)
 class AnalysisResultAdmin(admin.ModelAdmin):
     list_display = ['id', 'bill', 'costo_estimado_mxn', 'co2e_kg', 'confianza_global', 'created_at']
-    list_filter = ['confianza_global', 'created_at']
\ No newline at end of file
+    list_select_related = ['bill']
+    list_filter = ['confianza_global', ('created_at', DateFieldListFilter)]
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        # El changelist solo muestra columnas escalares
+        return super().get_queryset(request).defer(*AnalysisResult.objects.JSON_FIELDS)
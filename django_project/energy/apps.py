@@ -0,0 +1,12 @@
+"""
+App config de energy: registra las señales.
+"""
+
+from django.apps import AppConfig
+
+
+class EnergyConfig(AppConfig):
+    name = 'energy'
+
+    def ready(self):
+        from . import signals  # noqa: F401  (registra los receivers)
@@ -0,0 +1,38 @@
+"""
+Custom model fields for the Electric Assistant MVP.
+"""
+
+import orjson
+from django.db import models
+
+
+class ORJSONField(models.JSONField):
+    """
+    JSONField que serializa/deserializa con orjson en lugar de `json`.
+
+    Las respuestas de la encuesta y los resultados de análisis se leen en
+    cada vista; orjson decodifica varias veces más rápido que la stdlib.
+    En PostgreSQL la codificación la sigue haciendo el adaptador jsonb del
+    driver; solo la lectura pasa por orjson.
+    """
+
+    def from_db_value(self, value, expression, connection):
+        if value is None or self.decoder is not None:
+            return super().from_db_value(value, expression, connection)
+        # SQLite devuelve valores no-string ya convertidos en KeyTransforms
+        if not isinstance(value, (str, bytes)):
+            return value
+        try:
+            return orjson.loads(value)
+        except orjson.JSONDecodeError:
+            return value
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        # Expresiones (F, Value, subconsultas) se compilan aparte, como en JSONField
+        if hasattr(value, 'as_sql'):
+            return value
+        if connection.vendor == 'postgresql' or self.encoder is not None:
+            return super().get_db_prep_value(value, connection, prepared)
+        if not prepared:
+            value = self.get_prep_value(value)
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
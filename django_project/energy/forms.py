@@ -11,6 +11,10 @@ from .models import Bill
 # CSS reutilizable para inputs
 # ---------------------------------------------------------------------------
 _INPUT_CSS = 'w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-green-500'
+_BASE_ATTRS = {'class': _INPUT_CSS}
+_DATE_ATTRS = {**_BASE_ATTRS, 'type': 'date'}
+_MONEY_ATTRS = {**_BASE_ATTRS, 'step': '0.01'}
+_OPCIONAL_ATTRS = {**_BASE_ATTRS, 'placeholder': 'Opcional'}
 
 
 class BillForm(forms.ModelForm):
@@ -18,7 +22,7 @@ class BillForm(forms.ModelForm):
     
     class Meta:
         model = Bill
-        fields = [
+        fields = (
             'tarifa', 'periodo_inicio', 'periodo_fin', 'consumo_kwh',
             'total_recibo_mxn', 'lectura_anterior', 'lectura_actual',
             'multiplicador', 'subsidio_mxn',
@@ -27,55 +31,43 @@ class BillForm(forms.ModelForm):
             'subtotal_basico_mxn', 'subtotal_intermedio_mxn', 'subtotal_excedente_mxn',
             # Evidencia
             'evidencia_archivo',
-        ]
+        )
         widgets = {
-            'tarifa': forms.Select(attrs={'class': _INPUT_CSS}),
-            'periodo_inicio': forms.DateInput(attrs={
-                'type': 'date', 'class': _INPUT_CSS,
-            }),
-            'periodo_fin': forms.DateInput(attrs={
-                'type': 'date', 'class': _INPUT_CSS,
-            }),
+            'tarifa': forms.Select(attrs=_BASE_ATTRS),
+            'periodo_inicio': forms.DateInput(attrs=_DATE_ATTRS),
+            'periodo_fin': forms.DateInput(attrs=_DATE_ATTRS),
             'consumo_kwh': forms.NumberInput(attrs={
-                'class': _INPUT_CSS, 'placeholder': 'Ej: 280', 'min': 1, 'max': 20000,
+                **_BASE_ATTRS, 'placeholder': 'Ej: 280', 'min': 1, 'max': 20000,
             }),
             'total_recibo_mxn': forms.NumberInput(attrs={
-                'class': _INPUT_CSS, 'placeholder': 'Ej: 450.00', 'step': '0.01',
-            }),
-            'lectura_anterior': forms.NumberInput(attrs={
-                'class': _INPUT_CSS, 'placeholder': 'Opcional',
-            }),
-            'lectura_actual': forms.NumberInput(attrs={
-                'class': _INPUT_CSS, 'placeholder': 'Opcional',
-            }),
-            'multiplicador': forms.NumberInput(attrs={
-                'class': _INPUT_CSS, 'value': 1,
-            }),
-            'subsidio_mxn': forms.NumberInput(attrs={
-                'class': _INPUT_CSS, 'placeholder': 'Opcional', 'step': '0.01',
+                **_MONEY_ATTRS, 'placeholder': 'Ej: 450.00',
             }),
+            'lectura_anterior': forms.NumberInput(attrs=_OPCIONAL_ATTRS),
+            'lectura_actual': forms.NumberInput(attrs=_OPCIONAL_ATTRS),
+            'multiplicador': forms.NumberInput(attrs={**_BASE_ATTRS, 'value': 1}),
+            'subsidio_mxn': forms.NumberInput(attrs={**_OPCIONAL_ATTRS, 'step': '0.01'}),
             # --- Escalones tarifarios ---
             'periodo_basico_kwh': forms.NumberInput(attrs={
-                'class': _INPUT_CSS, 'placeholder': 'kWh básicos', 'min': 0,
+                **_BASE_ATTRS, 'placeholder': 'kWh básicos', 'min': 0,
             }),
             'periodo_intermedio_kwh': forms.NumberInput(attrs={
-                'class': _INPUT_CSS, 'placeholder': 'kWh intermedios', 'min': 0,
+                **_BASE_ATTRS, 'placeholder': 'kWh intermedios', 'min': 0,
             }),
             'periodo_excedente_kwh': forms.NumberInput(attrs={
-                'class': _INPUT_CSS, 'placeholder': 'kWh excedentes', 'min': 0,
+                **_BASE_ATTRS, 'placeholder': 'kWh excedentes', 'min': 0,
             }),
             'subtotal_basico_mxn': forms.NumberInput(attrs={
-                'class': _INPUT_CSS, 'placeholder': 'Subtotal básico', 'step': '0.01', 'min': 0,
+                **_MONEY_ATTRS, 'placeholder': 'Subtotal básico', 'min': 0,
             }),
             'subtotal_intermedio_mxn': forms.NumberInput(attrs={
-                'class': _INPUT_CSS, 'placeholder': 'Subtotal intermedio', 'step': '0.01', 'min': 0,
+                **_MONEY_ATTRS, 'placeholder': 'Subtotal intermedio', 'min': 0,
             }),
             'subtotal_excedente_mxn': forms.NumberInput(attrs={
-                'class': _INPUT_CSS, 'placeholder': 'Subtotal excedente', 'step': '0.01', 'min': 0,
+                **_MONEY_ATTRS, 'placeholder': 'Subtotal excedente', 'min': 0,
             }),
             # --- Evidencia ---
             'evidencia_archivo': forms.FileInput(attrs={
-                'class': _INPUT_CSS, 'accept': '.pdf,.jpg,.jpeg,.png',
+                **_BASE_ATTRS, 'accept': '.pdf,.jpg,.jpeg,.png',
             }),
         }
         labels = {
@@ -103,7 +95,6 @@ class BillForm(forms.ModelForm):
         cleaned_data = super().clean()
         periodo_inicio = cleaned_data.get('periodo_inicio')
         periodo_fin = cleaned_data.get('periodo_fin')
-        consumo_kwh = cleaned_data.get('consumo_kwh')
 
         # Validar que periodo_fin > periodo_inicio
         if periodo_inicio and periodo_fin:
@@ -112,12 +103,6 @@ class BillForm(forms.ModelForm):
                     'La fecha de fin debe ser posterior a la fecha de inicio.'
                 )
 
-        # Validar que la suma de escalones no exceda el consumo total (si se proporcionan)
-        basico = cleaned_data.get('periodo_basico_kwh') or 0
-        intermedio = cleaned_data.get('periodo_intermedio_kwh') or 0
-        excedente = cleaned_data.get('periodo_excedente_kwh') or 0
-
-        
         return cleaned_data
 
 
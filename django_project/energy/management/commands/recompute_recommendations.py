@@ -0,0 +1,53 @@
+"""
+Command to regenerate the OpenAI recommendations of existing bills.
+Surveys are sent in batches (one API call per batch) and the results
+are stored in each bill's AnalysisResult.
+"""
+
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from energy.models import Bill, AnalysisResult
+from energy.services.calculations import compute_all
+from energy.services.recommendations import get_recommendations_batch
+
+
+class Command(BaseCommand):
+    help = 'Regenerates recommendations for bills that have a survey'
+
+    def add_arguments(self, parser):
+        parser.add_argument('bill_ids', nargs='*', type=int,
+                            help='Bills to process (default: all with a survey)')
+        parser.add_argument('--batch-size', type=int, default=5,
+                            help='Surveys per OpenAI request')
+
+    def handle(self, *args, **options):
+        bills = Bill.objects.with_details().filter(survey__isnull=False).order_by('id')
+        if options['bill_ids']:
+            bills = bills.filter(id__in=options['bill_ids'])
+        bills = list(bills)
+        batch_size = max(1, options['batch_size'])
+
+        fallidos = 0
+        for start in range(0, len(bills), batch_size):
+            lote = bills[start:start + batch_size]
+            jobs = [(b.survey.respuestas, b.tarifa, b.consumo_kwh) for b in lote]
+            for bill, recs in zip(lote, get_recommendations_batch(jobs)):
+                if not recs:
+                    # Respuesta truncada o fallida: conservar el análisis actual
+                    fallidos += 1
+                    self.stderr.write(f'  Bill {bill.id}: sin recomendaciones, se conserva el análisis')
+                    continue
+                calc = compute_all(bill)
+                AnalysisResult.objects.update_or_create(
+                    bill=bill,
+                    defaults={
+                        'costo_estimado_mxn': Decimal(str(calc['costo'])),
+                        'co2e_kg': Decimal(str(calc['co2e'])),
+                        'recomendaciones_json': recs,
+                    },
+                )
+                self.stdout.write(f'  Bill {bill.id}: {len(recs)} recomendaciones')
+
+        self.stdout.write(self.style.SUCCESS(f'✅ {len(bills) - fallidos} bills processed.'))
+        if fallidos:
+            self.stdout.write(self.style.WARNING(f'⚠️  {fallidos} bills failed (unchanged).'))
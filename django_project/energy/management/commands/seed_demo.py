@@ -5,27 +5,96 @@ Creates two example bills with surveys (new JSONField format).
 
 from datetime import date, timedelta
 from decimal import Decimal
+from types import MappingProxyType
+from django.core.cache import cache
 from django.core.management.base import BaseCommand
-from energy.models import Bill, Survey, AnalysisResult
-from energy.services.calculations import compute_cost_mxn, compute_co2e_kg
+from django.db import transaction
+from energy.models import Bill, Survey, AnalysisResult, Tarifa
+from energy.signals import invalidate_demo_bills, results_cache_key
+
+
+# Campos que identifican a un demo entre ejecuciones
+_DEMO_NATURAL_KEY = ('is_demo', 'tarifa', 'consumo_kwh')
+
+# Respuestas canónicas de los demos (fuente única; se copian al guardar)
+# Demo 1: consumo medio, sin A/C, agua caliente por gas
+_DEMO1_RESPUESTAS = MappingProxyType({
+    "cambios_recientes": ["mas_tiempo_casa"],
+    "tiene_ac": "no",
+    "agua_caliente_tipo": "gas",
+    "refrigeradores": "1",
+    "ref_antiguedad": "medio",
+    "tiene_secadora": "no",
+    "tiene_bomba": "no",
+    "tiene_bomba_alberca": "no",
+    "calefactor": "no",
+    "cocina_tipo": "gas",
+    "cocina_horno": "no",
+    "cocina_airfryer": "no",
+    "cocina_parrilla": "no",
+    "cocina_hervidor": "diario",
+    "tvs": "1",
+    "pc_uso": "4-8",
+    "consola": "no",
+    "siempre_encendidos": ["router"],
+    "culpables_ocultos": ["dispensador_agua"],
+    "culpables_uso": "1-2",
+})
+
+# Demo 2: alto consumo, DAC, 2 A/C, agua eléctrica, secadora
+_DEMO2_RESPUESTAS = MappingProxyType({
+    "cambios_recientes": ["ola_calor", "aparato_nuevo"],
+    "tiene_ac": "minisplit_no_inverter",
+    "ac_unidades": "2",
+    "ac_dias_semana": "7",
+    "ac_horas_dia": "6-8",
+    "ac_temperatura": "21-23",
+    "agua_caliente_tipo": "electrico",
+    "agua_caliente_equipo": ["boiler_electrico"],
+    "agua_personas": "3-4",
+    "agua_duracion": "11-15",
+    "refrigeradores": "2",
+    "ref_antiguedad": "viejo",
+    "tiene_secadora": "electrica",
+    "secadora_cargas": "3-4",
+    "secadora_alto_calor": "si",
+    "tiene_bomba": "si",
+    "bomba_frecuencia": "mucho",
+    "tiene_bomba_alberca": "si",
+    "bomba_alberca_horas": "6+",
+    "calefactor": "no",
+    "cocina_tipo": "mixta",
+    "cocina_horno": "1-2",
+    "cocina_airfryer": "4+",
+    "cocina_parrilla": "poco",
+    "cocina_hervidor": "diario",
+    "tvs": "2",
+    "pc_uso": "9+",
+    "consola": "4+",
+    "siempre_encendidos": ["router", "camaras", "servidor"],
+    "culpables_ocultos": ["lavavajillas", "deshumidificador", "enfriador_aire"],
+    "culpables_uso": "3-5",
+})
 
 
 class Command(BaseCommand):
     help = 'Seeds the database with demo bills and surveys'
 
+    @transaction.atomic
     def handle(self, *args, **options):
         self.stdout.write('Creating demo data...')
-        
-        # Clear existing demo data
-        Bill.objects.filter(is_demo=True).delete()
+
+        # Mismo periodo para todos los demos
+        today = date.today()
+        sixty_days_ago = today - timedelta(days=60)
         
         # ──────────────────────────────────────────────────────────────
         # Demo 1: consumo medio, sin A/C, agua caliente por gas
         # ──────────────────────────────────────────────────────────────
-        demo1_bill = Bill.objects.create(
-            tarifa='1C',
-            periodo_inicio=date.today() - timedelta(days=60),
-            periodo_fin=date.today(),
+        demo1_bill = dict(
+            tarifa=Tarifa.UNO_C,
+            periodo_inicio=sixty_days_ago,
+            periodo_fin=today,
             consumo_kwh=280,
             total_recibo_mxn=Decimal('245.00'),
             periodo_basico_kwh=150,
@@ -38,43 +107,13 @@ class Command(BaseCommand):
             is_demo=True
         )
         
-        Survey.objects.create(
-            bill=demo1_bill,
-            respuestas={
-                "cambios_recientes": ["mas_tiempo_casa"],
-                "tiene_ac": "no",
-                "agua_caliente_tipo": "gas",
-                "refrigeradores": "1",
-                "ref_antiguedad": "medio",
-                "tiene_secadora": "no",
-                "tiene_bomba": "no",
-                "tiene_bomba_alberca": "no",
-                "calefactor": "no",
-                "cocina_tipo": "gas",
-                "cocina_horno": "no",
-                "cocina_airfryer": "no",
-                "cocina_parrilla": "no",
-                "cocina_hervidor": "diario",
-                "tvs": "1",
-                "pc_uso": "4-8",
-                "consola": "no",
-                "siempre_encendidos": ["router"],
-                "culpables_ocultos": ["dispensador_agua"],
-                "culpables_uso": "1-2",
-            }
-        )
-        
-        self.stdout.write(self.style.SUCCESS(
-            f'  ✓ Demo 1: {demo1_bill.consumo_kwh} kWh, Tarifa {demo1_bill.tarifa}'
-        ))
-        
         # ──────────────────────────────────────────────────────────────
         # Demo 2: alto consumo, DAC, 2 A/C, agua eléctrica, secadora
         # ──────────────────────────────────────────────────────────────
-        demo2_bill = Bill.objects.create(
-            tarifa='DAC',
-            periodo_inicio=date.today() - timedelta(days=60),
-            periodo_fin=date.today(),
+        demo2_bill = dict(
+            tarifa=Tarifa.DAC,
+            periodo_inicio=sixty_days_ago,
+            periodo_fin=today,
             consumo_kwh=800,
             total_recibo_mxn=Decimal('3200.00'),
             periodo_basico_kwh=150,
@@ -87,46 +126,44 @@ class Command(BaseCommand):
             is_demo=True
         )
         
-        Survey.objects.create(
-            bill=demo2_bill,
-            respuestas={
-                "cambios_recientes": ["ola_calor", "aparato_nuevo"],
-                "tiene_ac": "minisplit_no_inverter",
-                "ac_unidades": "2",
-                "ac_dias_semana": "7",
-                "ac_horas_dia": "6-8",
-                "ac_temperatura": "21-23",
-                "agua_caliente_tipo": "electrico",
-                "agua_caliente_equipo": ["boiler_electrico"],
-                "agua_personas": "3-4",
-                "agua_duracion": "11-15",
-                "refrigeradores": "2",
-                "ref_antiguedad": "viejo",
-                "tiene_secadora": "electrica",
-                "secadora_cargas": "3-4",
-                "secadora_alto_calor": "si",
-                "tiene_bomba": "si",
-                "bomba_frecuencia": "mucho",
-                "tiene_bomba_alberca": "si",
-                "bomba_alberca_horas": "6+",
-                "calefactor": "no",
-                "cocina_tipo": "mixta",
-                "cocina_horno": "1-2",
-                "cocina_airfryer": "4+",
-                "cocina_parrilla": "poco",
-                "cocina_hervidor": "diario",
-                "tvs": "2",
-                "pc_uso": "9+",
-                "consola": "4+",
-                "siempre_encendidos": ["router", "camaras", "servidor"],
-                "culpables_ocultos": ["lavavajillas", "deshumidificador", "enfriador_aire"],
-                "culpables_uso": "3-5",
-            }
-        )
-        
-        self.stdout.write(self.style.SUCCESS(
-            f'  ✓ Demo 2: {demo2_bill.consumo_kwh} kWh, Tarifa {demo2_bill.tarifa}'
-        ))
+        bills = [
+            self._upsert_demo(demo1_bill, dict(_DEMO1_RESPUESTAS)),
+            self._upsert_demo(demo2_bill, dict(_DEMO2_RESPUESTAS)),
+        ]
+        self._clear_demo_data(keep_ids=[bill.id for bill in bills])
+        invalidate_demo_bills()  # _raw_delete no dispara post_delete
+
+        for n, bill in enumerate(bills, start=1):
+            self.stdout.write(self.style.SUCCESS(
+                f'  ✓ Demo {n}: {bill.consumo_kwh} kWh, Tarifa {bill.tarifa}'
+            ))
         
         self.stdout.write(self.style.SUCCESS('\n✅ Demo data created successfully!'))
-        self.stdout.write('   Visit http://localhost:8000 to see the demos.')
\ No newline at end of file
+        self.stdout.write('   Visit http://localhost:8000 to see the demos.')
+
+    def _upsert_demo(self, campos, respuestas):
+        """
+        Crea o actualiza un demo usando su clave natural, de modo que
+        re-ejecutar el comando conserva los ids (y su AnalysisResult ya
+        calculado) en lugar de borrar y recrear todo.
+        """
+        clave = {k: campos[k] for k in _DEMO_NATURAL_KEY}
+        bill, _ = Bill.objects.update_or_create(**clave, defaults=campos)
+        Survey.objects.update_or_create(bill=bill, defaults={'respuestas': respuestas})
+        return bill
+
+    def _clear_demo_data(self, keep_ids=()):
+        """
+        Borra los demos obsoletos con un DELETE directo por tabla, sin pasar
+        por el collector de Django (no carga objetos ni dispara señales).
+        Las FKs no tienen ON DELETE CASCADE en la BD, así que primero se
+        borran las tablas dependientes.
+        """
+        obsoletos = Bill.objects.filter(is_demo=True).exclude(id__in=keep_ids)
+        cache.delete_many([results_cache_key(i) for i in obsoletos.values_list('id', flat=True)])
+        for qs in (
+            Survey.objects.filter(bill__is_demo=True).exclude(bill_id__in=keep_ids),
+            AnalysisResult.objects.filter(bill__is_demo=True).exclude(bill_id__in=keep_ids),
+            Bill.objects.filter(is_demo=True).exclude(id__in=keep_ids),
+        ):
+            qs._raw_delete(qs.db)
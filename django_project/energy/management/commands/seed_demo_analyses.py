@@ -0,0 +1,63 @@
+"""
+Command to precompute the AnalysisResult of every demo bill that does not
+have one yet, so the demos never wait on OpenAI when a visitor opens them.
+Recommendations are requested in batches (one API call per batch, like
+recompute_recommendations) and all rows are inserted with one bulk_create.
+Bills that get no recommendations are left without an analysis so the
+next run retries them.
+"""
+
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from energy.models import Bill, AnalysisResult
+from energy.services.calculations import compute_all, compute_rec_totals
+from energy.services.recommendations import get_recommendations_batch
+
+
+class Command(BaseCommand):
+    help = 'Precomputes analyses for demo bills that have a survey but no analysis'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5,
+                            help='Surveys per OpenAI request')
+
+    def handle(self, *args, **options):
+        bills = list(
+            Bill.objects.select_related('survey')
+            .filter(is_demo=True, survey__isnull=False, analysis__isnull=True)
+            .order_by('id')
+        )
+        if not bills:
+            self.stdout.write('Nothing to do.')
+            return
+
+        batch_size = max(1, options['batch_size'])
+        analyses = []
+        fallidos = 0
+        for start in range(0, len(bills), batch_size):
+            lote = bills[start:start + batch_size]
+            jobs = [(b.survey.respuestas, b.tarifa, b.consumo_kwh) for b in lote]
+            for bill, recs in zip(lote, get_recommendations_batch(jobs)):
+                if recs:
+                    analyses.append(self._analysis(bill, recs))
+                else:
+                    fallidos += 1
+
+        # ignore_conflicts: si otro proceso ya creó el análisis, se conserva
+        AnalysisResult.objects.bulk_create(analyses, batch_size=1000, ignore_conflicts=True)
+        self.stdout.write(self.style.SUCCESS(f'✅ {len(analyses)} demo analyses created.'))
+        if fallidos:
+            self.stdout.write(self.style.WARNING(f'⚠️  {fallidos} bills without recommendations (retry later).'))
+
+    def _analysis(self, bill, recs):
+        calc = compute_all(bill)
+        # bulk_create no pasa por AnalysisResult.save()
+        ahorro, co2 = compute_rec_totals(recs)
+        return AnalysisResult(
+            bill=bill,
+            costo_estimado_mxn=Decimal(str(calc['costo'])),
+            co2e_kg=Decimal(str(calc['co2e'])),
+            recomendaciones_json=recs,
+            total_ahorro_anual_mxn=ahorro,
+            total_co2_kg=co2,
+        )
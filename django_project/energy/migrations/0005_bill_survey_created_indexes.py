@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-15 22:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('energy', '0004_alter_bill_consumo_kwh'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['-created_at'], name='bill_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['tarifa', '-created_at'], name='bill_tarifa_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='survey',
+            index=models.Index(fields=['-created_at'], name='survey_created_idx'),
+        ),
+    ]
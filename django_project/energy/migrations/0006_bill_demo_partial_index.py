@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-15 22:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('energy', '0005_bill_survey_created_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(condition=models.Q(('is_demo', True)), fields=['is_demo'], name='bill_demo_idx'),
+        ),
+    ]
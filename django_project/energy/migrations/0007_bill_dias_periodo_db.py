@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-15 22:05
+
+import energy.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('energy', '0006_bill_demo_partial_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bill',
+            name='dias_periodo_db',
+            field=models.GeneratedField(db_persist=True, expression=energy.models.DiasEntre('periodo_fin', 'periodo_inicio'), output_field=models.IntegerField()),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-15 22:05
+
+import django.db.models.fields.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('energy', '0007_bill_dias_periodo_db'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='survey',
+            name='tiene_ac',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.fields.json.KeyTextTransform('tiene_ac', 'respuestas'), output_field=models.CharField(max_length=32, null=True)),
+        ),
+        migrations.AddIndex(
+            model_name='survey',
+            index=models.Index(fields=['tiene_ac'], name='survey_tiene_ac_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-15 22:06
+
+import energy.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('energy', '0008_survey_tiene_ac'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='analysisresult',
+            name='breakdown_json',
+            field=energy.fields.ORJSONField(default=dict),
+        ),
+        migrations.AlterField(
+            model_name='analysisresult',
+            name='recomendaciones_json',
+            field=energy.fields.ORJSONField(default=list),
+        ),
+        migrations.AlterField(
+            model_name='analysisresult',
+            name='supuestos_json',
+            field=energy.fields.ORJSONField(default=list),
+        ),
+        migrations.AlterField(
+            model_name='survey',
+            name='respuestas',
+            field=energy.fields.ORJSONField(default=dict),
+        ),
+    ]
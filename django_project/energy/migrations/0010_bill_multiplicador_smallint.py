@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-15 22:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('energy', '0009_orjson_fields'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bill',
+            name='multiplicador',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+    ]
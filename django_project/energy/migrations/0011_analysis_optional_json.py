@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-15 22:07
+
+import energy.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('energy', '0010_bill_multiplicador_smallint'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='analysisresult',
+            name='breakdown_json',
+            field=energy.fields.ORJSONField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='analysisresult',
+            name='supuestos_json',
+            field=energy.fields.ORJSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-15 22:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('energy', '0011_analysis_optional_json'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['periodo_fin'], name='bill_periodo_fin_idx'),
+        ),
+    ]
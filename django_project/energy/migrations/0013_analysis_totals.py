@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-15 22:22
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def calcular_totales(apps, schema_editor):
+    # Cálculo copiado aquí a propósito: la migración no depende del código actual
+    AnalysisResult = apps.get_model('energy', 'AnalysisResult')
+    filas = list(AnalysisResult.objects.only('id', 'recomendaciones_json'))
+    for fila in filas:
+        ahorro = 0.0
+        co2 = 0.0
+        for r in fila.recomendaciones_json or ():
+            ahorro += float(r.get('ahorro_anual_mxn') or 0)
+            co2 += float(r.get('reduccion_co2_kg_anual') or 0)
+        fila.total_ahorro_anual_mxn = Decimal(str(round(ahorro, 2)))
+        fila.total_co2_kg = Decimal(str(round(co2, 2)))
+    AnalysisResult.objects.bulk_update(
+        filas, ['total_ahorro_anual_mxn', 'total_co2_kg'], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('energy', '0012_bill_periodo_fin_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisresult',
+            name='total_ahorro_anual_mxn',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='analysisresult',
+            name='total_co2_kg',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=10),
+        ),
+        migrations.RunPython(calcular_totales, migrations.RunPython.noop),
+    ]
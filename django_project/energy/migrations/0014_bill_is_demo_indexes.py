@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-15 22:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('energy', '0013_analysis_totals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['is_demo', 'id'], name='bill_is_demo_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['is_demo', '-created_at'], name='bill_is_demo_created_idx'),
+        ),
+    ]
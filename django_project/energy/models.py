@@ -2,29 +2,68 @@
 Models for the Electric Assistant MVP.
 """
 
+import sys
 from decimal import Decimal
 from django.db import models
+from django.db.models.fields.json import KeyTextTransform
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils.functional import cached_property
+
+from .fields import ORJSONField
+
+
+# Constantes Decimal (inmutables) reutilizadas por las propiedades de Bill
+_ZERO = Decimal('0.00')
+_CENTS = Decimal('0.01')
+_ZERO_TENTH = Decimal('0.0')
+_TENTH = Decimal('0.1')
+_IVA_RATE = Decimal('0.16')
+_DAP_RATE = Decimal('0.05')  # Derecho de Alumbrado Público (aprox.)
+
+
+class DiasEntre(models.Func):
+    """Días entre dos fechas como entero (expresión determinista para GeneratedField)."""
+
+    arity = 2
+    template = '(%(expressions)s)'
+    arg_joiner = ' - '
+    output_field = models.IntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='CAST(julianday(%(expressions)s) AS INTEGER)',
+            arg_joiner=') - julianday(',
+            **extra_context,
+        )
+
+
+class Tarifa(models.TextChoices):
+    """Tarifas domésticas de CFE."""
+
+    UNO = '1', '1 - Básica'
+    UNO_A = '1A', '1A - Cálido extremo'
+    UNO_B = '1B', '1B - Cálido'
+    UNO_C = '1C', '1C - Cálido templado'
+    UNO_D = '1D', '1D - Cálido húmedo'
+    UNO_E = '1E', '1E - Cálido muy cálido'
+    UNO_F = '1F', '1F - Cálido extremo prolongado'
+    DAC = 'DAC', 'DAC - Doméstica Alto Consumo'
+    DESCONOZCO = 'DESCONOZCO', 'No sé mi tarifa'
+
+
+class BillManager(models.Manager):
+    def with_details(self):
+        """Recibos con su encuesta y análisis (relaciones 1:1) en un solo JOIN."""
+        return self.get_queryset().select_related('survey', 'analysis')
 
 
 class Bill(models.Model):
     """Modelo para el recibo de CFE."""
     
-    TARIFA_CHOICES = [
-        ('1', '1 - Básica'),
-        ('1A', '1A - Cálido extremo'),
-        ('1B', '1B - Cálido'),
-        ('1C', '1C - Cálido templado'),
-        ('1D', '1D - Cálido húmedo'),
-        ('1E', '1E - Cálido muy cálido'),
-        ('1F', '1F - Cálido extremo prolongado'),
-        ('DAC', 'DAC - Doméstica Alto Consumo'),
-        ('DESCONOZCO', 'No sé mi tarifa'),
-    ]
-    
     created_at = models.DateTimeField(auto_now_add=True)
     
-    tarifa = models.CharField(max_length=20, choices=TARIFA_CHOICES)
+    tarifa = models.CharField(max_length=20, choices=Tarifa.choices)
     periodo_inicio = models.DateField()
     periodo_fin = models.DateField()
     consumo_kwh = models.PositiveIntegerField(
@@ -36,7 +75,7 @@ class Bill(models.Model):
     )
     lectura_anterior = models.PositiveIntegerField(null=True, blank=True)
     lectura_actual = models.PositiveIntegerField(null=True, blank=True)
-    multiplicador = models.PositiveIntegerField(default=1)
+    multiplicador = models.PositiveSmallIntegerField(default=1)
     subsidio_mxn = models.DecimalField(
         max_digits=10, decimal_places=2, null=True, blank=True
     )
@@ -59,76 +98,127 @@ class Bill(models.Model):
     )
     
     is_demo = models.BooleanField(default=False)
+
+    # Calculado y almacenado por la BD al insertar/actualizar
+    dias_periodo_db = models.GeneratedField(
+        expression=DiasEntre('periodo_fin', 'periodo_inicio'),
+        output_field=models.IntegerField(),
+        db_persist=True,
+    )
     
+    objects = BillManager()
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at'], name='bill_created_idx'),
+            models.Index(fields=['tarifa', '-created_at'], name='bill_tarifa_created_idx'),
+            # Parcial: solo indexa los demos (pocas filas) para el borrado de seed_demo
+            models.Index(fields=['is_demo'], condition=models.Q(is_demo=True), name='bill_demo_idx'),
+            models.Index(fields=['periodo_fin'], name='bill_periodo_fin_idx'),
+            # home() filtra is_demo y ordena por id; listados por is_demo + fecha
+            models.Index(fields=['is_demo', 'id'], name='bill_is_demo_id_idx'),
+            models.Index(fields=['is_demo', '-created_at'], name='bill_is_demo_created_idx'),
+        ]
     
     def __str__(self):
         return f"Recibo {self.tarifa} - {self.consumo_kwh} kWh ({self.periodo_inicio} a {self.periodo_fin})"
     
+    # Las propiedades derivadas se memorizan por instancia: las plantillas
+    # las leen varias veces y los campos no cambian durante el render.
+
     def dias_periodo(self):
-        return (self.periodo_fin - self.periodo_inicio).days
+        # Instancias recién creadas aún no traen la columna generada de la BD
+        dias = self.__dict__.get('dias_periodo_db')
+        if dias is None:
+            return (self.periodo_fin - self.periodo_inicio).days
+        return dias
 
-    @property
+    @cached_property
     def consumo_basico(self):
         return self.periodo_basico_kwh or 0
 
-    @property
+    @cached_property
     def consumo_intermedio(self):
         return self.periodo_intermedio_kwh or 0
 
-    @property
+    @cached_property
     def consumo_excedente(self):
         return self.periodo_excedente_kwh or 0
 
-    @property
+    @cached_property
+    def _escalones_pct(self):
+        """(básico, intermedio, excedente) en % para las barras del dashboard."""
+        if self.consumo_excedente > 0:
+            return 100.0, 100.0, (self.consumo_excedente / self.consumo_kwh * 100) if self.consumo_kwh > 0 else 0
+        if self.consumo_intermedio > 0:
+            return 100.0, self.consumo_intermedio / 130 * 100, 0
+        if self.consumo_basico > 0:
+            return self.consumo_basico / 150 * 100, 0, 0
+        return 0, 0, 0
+
+    @cached_property
+    def basico_pct(self):
+        return self._escalones_pct[0]
+
+    @cached_property
+    def intermedio_pct(self):
+        return self._escalones_pct[1]
+
+    @cached_property
+    def excedente_pct(self):
+        return self._escalones_pct[2]
+
+    @cached_property
     def precio_unitario(self):
         if self.consumo_kwh and self.total_recibo_mxn:
-            return (self.total_recibo_mxn / self.consumo_kwh).quantize(Decimal('0.01'))
-        return Decimal('0.00')
+            return (self.total_recibo_mxn / self.consumo_kwh).quantize(_CENTS)
+        return _ZERO
 
-    @property
+    @cached_property
     def subsidio(self):
-        return self.subsidio_mxn or Decimal('0.00')
+        return self.subsidio_mxn or _ZERO
 
-    @property
+    @cached_property
     def demanda_max(self):
-        if self.dias_periodo() > 0:
-            return Decimal(self.consumo_kwh / self.dias_periodo()).quantize(Decimal('0.1'))
-        return Decimal('0.0')
+        dias = self.dias_periodo()
+        if dias > 0:
+            return (Decimal(self.consumo_kwh) / dias).quantize(_TENTH)
+        return _ZERO_TENTH
 
-    @property
+    @cached_property
     def subtotal_energia(self):
-        subtotal = Decimal('0.00')
-        if self.subtotal_basico_mxn:
-            subtotal += self.subtotal_basico_mxn
-        if self.subtotal_intermedio_mxn:
-            subtotal += self.subtotal_intermedio_mxn
-        if self.subtotal_excedente_mxn:
-            subtotal += self.subtotal_excedente_mxn
-        return subtotal
-
-    @property
+        return (
+            (self.subtotal_basico_mxn or _ZERO)
+            + (self.subtotal_intermedio_mxn or _ZERO)
+            + (self.subtotal_excedente_mxn or _ZERO)
+        )
+
+    @cached_property
     def iva(self):
-        return (self.subtotal_energia * Decimal('0.16')).quantize(Decimal('0.01'))
+        return (self.subtotal_energia * _IVA_RATE).quantize(_CENTS)
 
-    @property
+    @cached_property
+    def dap(self):
+        return (self.subtotal_energia * _DAP_RATE).quantize(_CENTS)
+
+    @cached_property
     def precio_basico(self):
         if self.consumo_basico and self.subtotal_basico_mxn:
-            return (self.subtotal_basico_mxn / self.consumo_basico).quantize(Decimal('0.01'))
-        return Decimal('0.00')
+            return (self.subtotal_basico_mxn / self.consumo_basico).quantize(_CENTS)
+        return _ZERO
 
-    @property
+    @cached_property
     def precio_intermedio(self):
         if self.consumo_intermedio and self.subtotal_intermedio_mxn:
-            return (self.subtotal_intermedio_mxn / self.consumo_intermedio).quantize(Decimal('0.01'))
-        return Decimal('0.00')
+            return (self.subtotal_intermedio_mxn / self.consumo_intermedio).quantize(_CENTS)
+        return _ZERO
 
-    @property
+    @cached_property
     def precio_excedente(self):
         if self.consumo_excedente and self.subtotal_excedente_mxn:
-            return (self.subtotal_excedente_mxn / self.consumo_excedente).quantize(Decimal('0.01'))
-        return Decimal('0.00')
+            return (self.subtotal_excedente_mxn / self.consumo_excedente).quantize(_CENTS)
+        return _ZERO
 
 
 class Survey(models.Model):
@@ -195,12 +285,68 @@ class Survey(models.Model):
     }
     """
     bill = models.OneToOneField(Bill, on_delete=models.CASCADE, related_name='survey')
-    respuestas = models.JSONField(default=dict)
+    respuestas = ORJSONField(default=dict)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Clave más consultada, extraída del JSON por la BD para poder indexarla
+    tiene_ac = models.GeneratedField(
+        expression=KeyTextTransform('tiene_ac', 'respuestas'),
+        output_field=models.CharField(max_length=32, null=True),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at'], name='survey_created_idx'),
+            models.Index(fields=['tiene_ac'], name='survey_tiene_ac_idx'),
+        ]
+
     def __str__(self):
         return f"Encuesta para {self.bill}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'respuestas' in instance.__dict__:
+            instance.respuestas = _intern_respuestas(instance.respuestas)
+        return instance
+
+    def save(self, *args, **kwargs):
+        self.respuestas = _intern_respuestas(self.respuestas)
+        super().save(*args, **kwargs)
+
+
+def _intern_respuestas(respuestas):
+    """
+    Internaliza los valores string de las respuestas (y de sus listas).
+    Son un vocabulario cerrado ("no", "gas", "1-2"…), así que todas las
+    encuestas en memoria comparten el mismo objeto por literal.
+    """
+    if not isinstance(respuestas, dict):
+        return respuestas
+    return {sys.intern(k): _intern_valor(v) for k, v in respuestas.items()}
+
+
+def _intern_valor(valor):
+    if isinstance(valor, str):
+        return sys.intern(valor)
+    if isinstance(valor, list):
+        return [sys.intern(x) if isinstance(x, str) else x for x in valor]
+    return valor
+
+
+class AnalysisResultManager(models.Manager):
+    """
+    Las vistas de detalle usan `.get(pk=...)` (carga los JSON completos);
+    los listados usan `.list_view()`, que no transfiere ni decodifica
+    las columnas JSON.
+    """
+
+    JSON_FIELDS = ('breakdown_json', 'recomendaciones_json', 'supuestos_json')
+
+    def list_view(self):
+        return self.defer(*self.JSON_FIELDS)
+
 
 class AnalysisResult(models.Model):
     """Resultados del análisis de consumo."""
@@ -217,13 +363,28 @@ class AnalysisResult(models.Model):
     costo_estimado_mxn = models.DecimalField(max_digits=10, decimal_places=2)
     co2e_kg = models.DecimalField(max_digits=10, decimal_places=2)
     
-    breakdown_json = models.JSONField(default=dict)
-    recomendaciones_json = models.JSONField(default=list)
-    supuestos_json = models.JSONField(default=list)
+    # El flujo con OpenAI no llena breakdown/supuestos: NULL en vez de
+    # serializar y guardar '{}' / '[]' en cada fila. Leer como `or {}` / `or []`.
+    breakdown_json = ORJSONField(null=True, blank=True)
+    recomendaciones_json = ORJSONField(default=list)
+    supuestos_json = ORJSONField(null=True, blank=True)
     
     confianza_global = models.CharField(
         max_length=10, choices=CONFIDENCE_CHOICES, default='medium'
     )
+
+    # Totales de recomendaciones_json, calculados al guardar (ver save())
+    total_ahorro_anual_mxn = models.DecimalField(max_digits=12, decimal_places=2, default=_ZERO)
+    total_co2_kg = models.DecimalField(max_digits=10, decimal_places=2, default=_ZERO)
+
+    objects = AnalysisResultManager()
     
     def __str__(self):
-        return f"Análisis: {self.costo_estimado_mxn} MXN, {self.co2e_kg} kg CO2e"
\ No newline at end of file
+        return f"Análisis: {self.costo_estimado_mxn} MXN, {self.co2e_kg} kg CO2e"
+
+    def save(self, *args, **kwargs):
+        if 'recomendaciones_json' in self.__dict__:  # no forzar la carga si está diferido
+            # Import local: services.calculations importa este módulo
+            from .services.calculations import compute_rec_totals
+            self.total_ahorro_anual_mxn, self.total_co2_kg = compute_rec_totals(self.recomendaciones_json)
+        super().save(*args, **kwargs)
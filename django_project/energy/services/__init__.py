@@ -1,2 +1,4 @@
-from .calculations import compute_cost_mxn, compute_co2e_kg, compute_breakdown_and_recs
-from .recommendations import get_recommendations
\ No newline at end of file
+from .calculations import compute_cost_mxn, compute_co2e_kg, compute_breakdown_and_recs, compute_all, compute_rec_totals
+from .recommendations import get_recommendations
+from .ingest import bulk_ingest_bills
+from .recommendations_async import get_recommendations_async, get_recommendations_many_async
@@ -5,16 +5,54 @@ NOTA IMPORTANTE: Estos cálculos son ESTIMACIONES basadas en reglas heurísticas
 No sustituyen una medición real del consumo. Las tarifas son aproximadas (2024).
 """
 
-from decimal import Decimal, ROUND_HALF_UP
+import heapq
+from decimal import Decimal
+from dataclasses import dataclass
+from functools import lru_cache
 from typing import Dict, List, Any
 
+from ..models import Tarifa
+
 
 # Factor de emisión CO2e para México (kgCO2e por kWh)
 # Fuente: Factor de Emisión del Sistema Eléctrico Nacional 2023
-CO2E_FACTOR = Decimal('0.444')
+CO2E_FACTOR = 0.444
+
+# Categorías del desglose
+CAT_REF = 'Refrigeración'
+CAT_STANDBY = 'Standby / Misceláneos'
+CAT_AC = 'Climatización (A/C)'
+CAT_AGUA = 'Agua caliente'
+CAT_LAV = 'Lavado'
+CAT_HO = 'Electrónicos / Home Office'
+CAT_BOMBEO = 'Bombeo de agua'
+CAT_OTROS = 'Otros'
+
+# Categorías que se pueden recortar para cuadrar al consumo total
+_FLEXIBLE_CATS = (CAT_AC, CAT_HO, CAT_STANDBY, CAT_BOMBEO)
+
+
+@dataclass(frozen=True, slots=True)
+class TariffSchedule:
+    """Escalones y precios ($/kWh) del modelo de costo simplificado."""
+    basico_kwh: float = 150.0          # primeros kWh a precio básico
+    intermedio_kwh: float = 130.0      # siguientes kWh a precio intermedio
+    limite_dac_kwh: float = 500.0      # por encima se cobra todo a precio DAC
+    precio_basico: float = 0.98
+    precio_intermedio: float = 1.19
+    precio_excedente: float = 3.52
+    precio_dac: float = 6.38
+    factor_iva: float = 1.16
+
+
+_SCHED_2024 = TariffSchedule()
 
 
-def compute_cost_mxn(consumo_kwh: int, tarifa: str) -> Decimal:
+# Los cálculos usan float y redondean a centavos solo al final; la conversión
+# a Decimal ocurre al guardar en los DecimalField de AnalysisResult.
+
+@lru_cache(maxsize=4096)
+def compute_cost_mxn(consumo_kwh: int, tarifa: str) -> float:
     """
     Calcula el costo estimado de la electricidad en MXN.
     
@@ -27,33 +65,33 @@ def compute_cost_mxn(consumo_kwh: int, tarifa: str) -> Decimal:
         tarifa: Código de tarifa CFE
     
     Returns:
-        Costo estimado en MXN (con IVA 16%)
+        Costo estimado en MXN (con IVA 16%), redondeado a centavos
     """
-    consumo = Decimal(consumo_kwh)
+    consumo = float(consumo_kwh)
+    sched = _SCHED_2024
     
     # Tarifa DAC o alto consumo
-    if tarifa == 'DAC' or consumo_kwh > 500:
-        costo_base = consumo * Decimal('6.38')
+    if tarifa == Tarifa.DAC or consumo > sched.limite_dac_kwh:
+        costo_base = consumo * sched.precio_dac
     else:
         # Tarifa escalonada simplificada
         # Básico: primeros 150 kWh
-        basico = min(consumo, Decimal('150')) * Decimal('0.98')
+        basico = min(consumo, sched.basico_kwh) * sched.precio_basico
         
         # Intermedio: siguientes 130 kWh (151-280)
-        intermedio = min(max(consumo - 150, 0), Decimal('130')) * Decimal('1.19')
+        intermedio = min(max(consumo - sched.basico_kwh, 0), sched.intermedio_kwh) * sched.precio_intermedio
         
         # Excedente: resto hasta 500 kWh
-        excedente = max(consumo - 280, 0) * Decimal('3.52')
+        excedente = max(consumo - sched.basico_kwh - sched.intermedio_kwh, 0) * sched.precio_excedente
         
         costo_base = basico + intermedio + excedente
     
     # Aplicar IVA 16%
-    costo_con_iva = costo_base * Decimal('1.16')
-    
-    return costo_con_iva.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    return round(costo_base * sched.factor_iva, 2)
 
 
-def compute_co2e_kg(consumo_kwh: int) -> Decimal:
+@lru_cache(maxsize=4096)
+def compute_co2e_kg(consumo_kwh: int) -> float:
     """
     Calcula las emisiones de CO2 equivalente.
     
@@ -61,11 +99,39 @@ def compute_co2e_kg(consumo_kwh: int) -> Decimal:
         consumo_kwh: Consumo en kWh del periodo
     
     Returns:
-        Emisiones en kg de CO2e
+        Emisiones en kg de CO2e, redondeadas a 2 decimales
     """
-    return (Decimal(consumo_kwh) * CO2E_FACTOR).quantize(
-        Decimal('0.01'), rounding=ROUND_HALF_UP
-    )
+    return round(consumo_kwh * CO2E_FACTOR, 2)
+
+
+def compute_all(bill) -> Dict[str, Any]:
+    """
+    Costo y CO2e del recibo en una sola llamada, para los puntos que arman
+    un AnalysisResult.
+
+    Returns:
+        Dict con costo y co2e
+    """
+    return {
+        'costo': compute_cost_mxn(bill.consumo_kwh, bill.tarifa),
+        'co2e': compute_co2e_kg(bill.consumo_kwh),
+    }
+
+
+def compute_rec_totals(recs) -> tuple:
+    """
+    Suma en una pasada el ahorro anual y el CO2 reducido de una lista de
+    recomendaciones (los totales guardados en AnalysisResult).
+
+    Returns:
+        (ahorro anual MXN, CO2 reducido kg) como Decimal con 2 decimales
+    """
+    ahorro = 0.0
+    co2 = 0.0
+    for r in recs or ():
+        ahorro += float(r.get('ahorro_anual_mxn') or 0)
+        co2 += float(r.get('reduccion_co2_kg_anual') or 0)
+    return Decimal(str(round(ahorro, 2))), Decimal(str(round(co2, 2)))
 
 
 def compute_breakdown_and_recs(bill, survey) -> Dict[str, Any]:
@@ -96,14 +162,14 @@ def compute_breakdown_and_recs(bill, survey) -> Dict[str, Any]:
     else:
         ref_kwh = ref_base
     
-    breakdown['Refrigeración'] = {
+    breakdown[CAT_REF] = {
         'kwh': ref_kwh,
         'confianza': 'high'
     }
     
     # 2. Standby y misceláneos (mínimo 30 kWh, máximo 10% del total)
     standby_kwh = max(30, int(consumo_total * 0.10))
-    breakdown['Standby / Misceláneos'] = {
+    breakdown[CAT_STANDBY] = {
         'kwh': standby_kwh,
         'confianza': 'low'
     }
@@ -118,7 +184,7 @@ def compute_breakdown_and_recs(bill, survey) -> Dict[str, Any]:
         ac_kwh = int(survey.ac_count * survey.ac_horas_dia * 1.2 * 60)
         # Cap al 60% del consumo total
         ac_kwh = min(ac_kwh, int(consumo_total * 0.60))
-        breakdown['Climatización (A/C)'] = {
+        breakdown[CAT_AC] = {
             'kwh': ac_kwh,
             'confianza': 'medium'
         }
@@ -129,7 +195,7 @@ def compute_breakdown_and_recs(bill, survey) -> Dict[str, Any]:
     if survey.agua_caliente == 'elec':
         # 60-120 kWh según personas
         agua_kwh = min(120, 40 + (survey.personas_en_casa * 15))
-        breakdown['Agua caliente'] = {
+        breakdown[CAT_AGUA] = {
             'kwh': agua_kwh,
             'confianza': 'medium'
         }
@@ -144,7 +210,7 @@ def compute_breakdown_and_recs(bill, survey) -> Dict[str, Any]:
         lavado_kwh += 120
         supuestos.append("Secadora eléctrica: ~120 kWh/bimestre estimado")
     if lavado_kwh > 0:
-        breakdown['Lavado'] = {
+        breakdown[CAT_LAV] = {
             'kwh': lavado_kwh,
             'confianza': 'medium' if survey.secadora else 'high'
         }
@@ -154,7 +220,7 @@ def compute_breakdown_and_recs(bill, survey) -> Dict[str, Any]:
     if survey.home_office:
         # 60-120 kWh para home office
         electronics_kwh = 80
-        breakdown['Electrónicos / Home Office'] = {
+        breakdown[CAT_HO] = {
             'kwh': electronics_kwh,
             'confianza': 'low'
         }
@@ -164,7 +230,7 @@ def compute_breakdown_and_recs(bill, survey) -> Dict[str, Any]:
     bombeo_kwh = 0
     if survey.bombeo_agua:
         bombeo_kwh = 50
-        breakdown['Bombeo de agua'] = {
+        breakdown[CAT_BOMBEO] = {
             'kwh': bombeo_kwh,
             'confianza': 'low'
         }
@@ -174,54 +240,52 @@ def compute_breakdown_and_recs(bill, survey) -> Dict[str, Any]:
     suma_parcial = sum(cat['kwh'] for cat in breakdown.values())
     
     if suma_parcial > consumo_total:
-        # Reducir categorías flexibles proporcionalmente
-        flexible_cats = ['Climatización (A/C)', 'Electrónicos / Home Office', 
-                         'Standby / Misceláneos', 'Bombeo de agua']
+        # Reducir categorías flexibles proporcionalmente: cada una absorbe
+        # su parte del exceso según su peso, con tope de 30% y piso de 10 kWh
         exceso = suma_parcial - consumo_total
+        flexibles = [breakdown[cat] for cat in _FLEXIBLE_CATS if cat in breakdown]
+        total_flexible = sum(cat['kwh'] for cat in flexibles)
         
-        for cat in flexible_cats:
-            if cat in breakdown and exceso > 0:
-                reduccion = min(breakdown[cat]['kwh'] * 0.3, exceso)
-                breakdown[cat]['kwh'] = max(10, int(breakdown[cat]['kwh'] - reduccion))
-                exceso -= reduccion
-        
-        suma_parcial = sum(cat['kwh'] for cat in breakdown.values())
+        if total_flexible:
+            fraccion = min(0.3, exceso / total_flexible)
+            for cat in flexibles:
+                cat['kwh'] = max(10, int(cat['kwh'] - cat['kwh'] * fraccion))
+            # Solo cambiaron las flexibles: se ajusta la suma sin recorrer todo
+            suma_parcial -= total_flexible - sum(cat['kwh'] for cat in flexibles)
     
     # Asignar residual a "Otros"
     residual = consumo_total - suma_parcial
     if residual > 5:
-        breakdown['Otros'] = {
+        breakdown[CAT_OTROS] = {
             'kwh': residual,
             'confianza': 'low'
         }
         supuestos.append(f"Otros consumos no identificados: {residual} kWh")
     elif residual < 0:
         # Ajustar standby si hay exceso
-        if 'Standby / Misceláneos' in breakdown:
-            breakdown['Standby / Misceláneos']['kwh'] = max(
-                10, breakdown['Standby / Misceláneos']['kwh'] + residual
+        if CAT_STANDBY in breakdown:
+            breakdown[CAT_STANDBY]['kwh'] = max(
+                10, breakdown[CAT_STANDBY]['kwh'] + residual
             )
     
     # Calcular porcentajes
-    for cat in breakdown:
-        breakdown[cat]['pct'] = round(breakdown[cat]['kwh'] / consumo_total * 100, 1)
+    inv_total = 100.0 / consumo_total
+    for cat in breakdown.values():
+        cat['pct'] = round(cat['kwh'] * inv_total, 1)
     
     # === RECOMENDACIONES ===
-    costo_por_kwh = compute_cost_mxn(consumo_total, bill.tarifa) / Decimal(consumo_total)
+    costo_por_kwh = compute_cost_mxn(consumo_total, bill.tarifa) / consumo_total
     recomendaciones = []
     
-    # Ordenar categorías por consumo
-    cats_ordenadas = sorted(breakdown.items(), key=lambda x: x[1]['kwh'], reverse=True)
-    
     # Recomendación de A/C
-    if 'Climatización (A/C)' in breakdown and breakdown['Climatización (A/C)']['kwh'] > 100:
-        ahorro_kwh = int(breakdown['Climatización (A/C)']['kwh'] * 0.12)
+    if CAT_AC in breakdown and breakdown[CAT_AC]['kwh'] > 100:
+        ahorro_kwh = int(breakdown[CAT_AC]['kwh'] * 0.12)
         recomendaciones.append({
             'titulo': 'Optimizar uso del aire acondicionado',
             'descripcion': 'Subir el termostato 2°C, limpiar filtros mensualmente, y sellar puertas/ventanas.',
             'ahorro_kwh': ahorro_kwh,
-            'ahorro_mxn': float((Decimal(ahorro_kwh) * costo_por_kwh).quantize(Decimal('0.01'))),
-            'ahorro_co2e': float(compute_co2e_kg(ahorro_kwh)),
+            'ahorro_mxn': round(ahorro_kwh * costo_por_kwh, 2),
+            'ahorro_co2e': compute_co2e_kg(ahorro_kwh),
             'costo': 'gratis',
             'dificultad': 'fácil'
         })
@@ -233,8 +297,8 @@ def compute_breakdown_and_recs(bill, survey) -> Dict[str, Any]:
             'titulo': 'Revisar refrigerador antiguo',
             'descripcion': 'Verificar sello de la puerta, ajustar temperatura a 4°C. A mediano plazo, considerar reemplazo.',
             'ahorro_kwh': ahorro_kwh,
-            'ahorro_mxn': float((Decimal(ahorro_kwh) * costo_por_kwh).quantize(Decimal('0.01'))),
-            'ahorro_co2e': float(compute_co2e_kg(ahorro_kwh)),
+            'ahorro_mxn': round(ahorro_kwh * costo_por_kwh, 2),
+            'ahorro_co2e': compute_co2e_kg(ahorro_kwh),
             'costo': 'bajo',
             'dificultad': 'fácil'
         })
@@ -245,21 +309,21 @@ def compute_breakdown_and_recs(bill, survey) -> Dict[str, Any]:
         'titulo': 'Cambiar a iluminación LED',
         'descripcion': 'Reemplazar focos incandescentes por LED y apagar luces al salir.',
         'ahorro_kwh': ahorro_led,
-        'ahorro_mxn': float((Decimal(ahorro_led) * costo_por_kwh).quantize(Decimal('0.01'))),
-        'ahorro_co2e': float(compute_co2e_kg(ahorro_led)),
+        'ahorro_mxn': round(ahorro_led * costo_por_kwh, 2),
+        'ahorro_co2e': compute_co2e_kg(ahorro_led),
         'costo': 'bajo',
         'dificultad': 'fácil'
     })
     
     # Recomendación de standby
-    if 'Standby / Misceláneos' in breakdown and breakdown['Standby / Misceláneos']['kwh'] > 40:
+    if CAT_STANDBY in breakdown and breakdown[CAT_STANDBY]['kwh'] > 40:
         ahorro_standby = 15
         recomendaciones.append({
             'titulo': 'Reducir consumo standby',
             'descripcion': 'Usar regletas con switch para apagar dispositivos completamente cuando no se usen.',
             'ahorro_kwh': ahorro_standby,
-            'ahorro_mxn': float((Decimal(ahorro_standby) * costo_por_kwh).quantize(Decimal('0.01'))),
-            'ahorro_co2e': float(compute_co2e_kg(ahorro_standby)),
+            'ahorro_mxn': round(ahorro_standby * costo_por_kwh, 2),
+            'ahorro_co2e': compute_co2e_kg(ahorro_standby),
             'costo': 'bajo',
             'dificultad': 'fácil'
         })
@@ -271,21 +335,21 @@ def compute_breakdown_and_recs(bill, survey) -> Dict[str, Any]:
             'titulo': 'Reducir uso de secadora',
             'descripcion': 'Secar ropa al aire libre cuando sea posible. Usar la secadora solo en emergencias.',
             'ahorro_kwh': ahorro_sec,
-            'ahorro_mxn': float((Decimal(ahorro_sec) * costo_por_kwh).quantize(Decimal('0.01'))),
-            'ahorro_co2e': float(compute_co2e_kg(ahorro_sec)),
+            'ahorro_mxn': round(ahorro_sec * costo_por_kwh, 2),
+            'ahorro_co2e': compute_co2e_kg(ahorro_sec),
             'costo': 'gratis',
             'dificultad': 'fácil'
         })
     
     # Ordenar por ahorro y tomar top 3
-    recomendaciones = sorted(recomendaciones, key=lambda x: x['ahorro_kwh'], reverse=True)[:3]
+    recomendaciones = heapq.nlargest(3, recomendaciones, key=lambda x: x['ahorro_kwh'])
     
     # === CONFIANZA GLOBAL ===
     # Alta: si tiene lecturas y total MXN declarado
     # Media: solo datos básicos
     # Baja: tarifa desconocida o datos incompletos
     
-    if bill.tarifa == 'DESCONOZCO':
+    if bill.tarifa == Tarifa.DESCONOZCO:
         confianza_global = 'low'
         supuestos.append("Tarifa desconocida: se usó tarifa promedio")
     elif bill.total_recibo_mxn and bill.lectura_anterior and bill.lectura_actual:
@@ -0,0 +1,59 @@
+"""
+Carga masiva de recibos (históricos, lotes de OCR) con bulk_create.
+
+Cada elemento de la entrada es un dict con los campos de Bill y,
+opcionalmente:
+    respuestas       → se crea el Survey del recibo
+    recomendaciones  → se crea el AnalysisResult (costo y CO2e calculados)
+
+Las tres tablas se insertan en una sola transacción; los ids de Bill
+vuelven del INSERT (RETURNING en SQLite ≥ 3.35 y PostgreSQL), así que
+Survey y AnalysisResult se arman después sin consultas extra.
+"""
+
+from decimal import Decimal
+from typing import Iterable, List
+
+from django.db import transaction
+
+from ..models import AnalysisResult, Bill, Survey, _intern_respuestas
+from .calculations import compute_all, compute_rec_totals
+
+
+BATCH_SIZE = 500
+
+_EXTRA_KEYS = ('respuestas', 'recomendaciones')
+
+
+@transaction.atomic
+def bulk_ingest_bills(raw_list: Iterable[dict]) -> List[Bill]:
+    """Crea los Bill (y sus Survey/AnalysisResult) y retorna los Bill creados."""
+    raw_list = list(raw_list)
+    bills = [
+        Bill(**{k: v for k, v in raw.items() if k not in _EXTRA_KEYS})
+        for raw in raw_list
+    ]
+    Bill.objects.bulk_create(bills, batch_size=BATCH_SIZE)
+
+    surveys = []
+    analyses = []
+    for bill, raw in zip(bills, raw_list):
+        if 'respuestas' in raw:
+            # bulk_create no pasa por Survey.save()
+            surveys.append(Survey(bill=bill, respuestas=_intern_respuestas(raw['respuestas'])))
+        if 'recomendaciones' in raw:
+            # bulk_create tampoco pasa por AnalysisResult.save()
+            ahorro, co2 = compute_rec_totals(raw['recomendaciones'])
+            calc = compute_all(bill)
+            analyses.append(AnalysisResult(
+                bill=bill,
+                costo_estimado_mxn=Decimal(str(calc['costo'])),
+                co2e_kg=Decimal(str(calc['co2e'])),
+                recomendaciones_json=raw['recomendaciones'],
+                total_ahorro_anual_mxn=ahorro,
+                total_co2_kg=co2,
+            ))
+
+    Survey.objects.bulk_create(surveys, batch_size=BATCH_SIZE)
+    AnalysisResult.objects.bulk_create(analyses, batch_size=BATCH_SIZE)
+    return bills
@@ -0,0 +1,49 @@
+"""
+Cache de respuestas de OpenAI por coincidencia exacta del request.
+
+La clave es el sha256 de (modelo, mensajes, temperatura) serializados con
+llaves ordenadas: dos encuestas con las mismas respuestas, tarifa y
+consumo producen el mismo prompt y reutilizan la respuesta guardada en
+vez de pagar otra llamada.  Se apoya en el framework de cache de Django,
+así que se comparte entre workers si el backend lo permite.
+"""
+
+import hashlib
+
+import orjson
+from django.core.cache import cache
+
+
+class LLMCache:
+    """get/set sobre `django.core.cache` con contadores de hits/misses."""
+
+    def __init__(self, prefix: str = "llm", ttl: int = 60 * 60 * 24 * 7):
+        self.prefix = prefix
+        self.ttl = ttl  # 7 días
+        self.stats = {"hits": 0, "misses": 0}
+
+    def cache_key(self, model: str, messages: list, temperature: float) -> str:
+        payload = orjson.dumps(
+            {"model": model, "messages": messages, "temperature": temperature},
+            option=orjson.OPT_SORT_KEYS,
+        )
+        return f"{self.prefix}:{hashlib.sha256(payload).hexdigest()}"
+
+    def get(self, key: str):
+        value = cache.get(key)
+        self.stats["hits" if value is not None else "misses"] += 1
+        return value
+
+    def set(self, key: str, value) -> None:
+        cache.set(key, value, self.ttl)
+
+    async def aget(self, key: str):
+        value = await cache.aget(key)
+        self.stats["hits" if value is not None else "misses"] += 1
+        return value
+
+    async def aset(self, key: str, value) -> None:
+        await cache.aset(key, value, self.ttl)
+
+
+llm_cache = LLMCache()
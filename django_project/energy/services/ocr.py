@@ -20,13 +20,20 @@ Campos adicionales para el dashboard (escalones tarifarios):
     subtotal_excedente_mxn  → subtotal_excedente_mxn
 """
 
+import asyncio
 import base64
-import json
+import io
+import mimetypes
+import mmap
 import re
-from datetime import datetime
+import weakref
+from datetime import date, datetime
+from functools import lru_cache
 from typing import Optional
 
-from openai import OpenAI
+import orjson
+from openai import AsyncOpenAI, OpenAI
+from PIL import Image, ImageOps
 
 
 # Prompt que pide SOLO los campos que el modelo necesita.
@@ -75,57 +82,117 @@ class CFEVisionExtractor:
     """Extrae datos de un recibo CFE usando GPT-4o-mini con visión."""
 
     def __init__(self, api_key: str):
-        self.client = OpenAI(api_key=api_key)
+        self.api_key = api_key
+        self.client = _get_client(api_key)
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        # Solo se crea si se usan los métodos async.  Uno por event loop: su
+        # pool de conexiones queda atado al loop (bajo WSGI cada request
+        # async corre en uno nuevo; bajo ASGI se reutiliza).
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = self._async_clients[loop] = AsyncOpenAI(api_key=self.api_key)
+        return client
 
     # ------------------------------------------------------------------
     # Público
     # ------------------------------------------------------------------
 
-    def extract(self, image_path: str) -> dict:
+    def extract(self, image_path: str, mime: Optional[str] = None) -> dict:
         """
         Recibe la ruta de una imagen y retorna un dict con los campos
         mapeados al modelo Bill.  Nunca lanza por parsing interno;
-        campos que no se pudieron extraer quedan en None.
+        campos que no se pudieron extraer quedan en None.  Sin `mime`, se
+        deduce de la extensión.
         """
-        b64 = self._encode_image(image_path)
-        raw = self._call_api(b64)
+        b64, mime = self._encode_path(image_path, mime)
+        raw = self._call_api(b64, mime)
         return self._map_to_bill_fields(raw)
 
     def extract_from_bytes(self, image_bytes: bytes, mime: str = "image/png") -> dict:
         """Versión que acepta bytes directamente (útil desde Django UploadedFile)."""
-        b64 = base64.b64encode(image_bytes).decode()
+        b64, mime = self._encode_bytes(image_bytes, mime)
+        raw = self._call_api(b64, mime)
+        return self._map_to_bill_fields(raw)
+
+    def extract_from_file(self, fileobj, mime: str = "image/png") -> dict:
+        """
+        Versión para archivos abiertos (p. ej. `UploadedFile.file`): PIL lee
+        directo del archivo, sin copiarlo antes a un `bytes`.
+        """
+        b64, mime = self._encode_file(fileobj, mime)
         raw = self._call_api(b64, mime)
         return self._map_to_bill_fields(raw)
 
+    # En las versiones async el preprocesado (decodificar, rotar, reducir y
+    # recomprimir con PIL) corre en un hilo para no bloquear el event loop.
+
+    async def extract_async(self, image_path: str, mime: Optional[str] = None) -> dict:
+        """Versión async de `extract`: no bloquea el worker durante la llamada."""
+        b64, mime = await asyncio.to_thread(self._encode_path, image_path, mime)
+        raw = await self._call_api_async(b64, mime)
+        return self._map_to_bill_fields(raw)
+
+    async def extract_from_bytes_async(self, image_bytes: bytes, mime: str = "image/png") -> dict:
+        """Versión async de `extract_from_bytes`."""
+        b64, mime = await asyncio.to_thread(self._encode_bytes, image_bytes, mime)
+        raw = await self._call_api_async(b64, mime)
+        return self._map_to_bill_fields(raw)
+
+    async def extract_from_file_async(self, fileobj, mime: str = "image/png") -> dict:
+        """Versión async de `extract_from_file`."""
+        b64, mime = await asyncio.to_thread(self._encode_file, fileobj, mime)
+        raw = await self._call_api_async(b64, mime)
+        return self._map_to_bill_fields(raw)
+
     # ------------------------------------------------------------------
     # Interno — llamada a la API
     # ------------------------------------------------------------------
 
+    def _encode_path(self, path: str, mime: Optional[str] = None) -> tuple:
+        """(base64, mime) de la imagen reducida; la original si PIL no la abre."""
+        procesada = _preprocess(path)
+        if procesada is None:
+            return self._encode_image(path), mime or mimetypes.guess_type(path)[0] or "image/png"
+        return base64.b64encode(procesada).decode("ascii"), "image/jpeg"
+
+    def _encode_bytes(self, image_bytes: bytes, mime: str) -> tuple:
+        procesada = _preprocess(io.BytesIO(image_bytes))
+        if procesada is not None:
+            image_bytes, mime = procesada, "image/jpeg"
+        return base64.b64encode(image_bytes).decode("ascii"), mime
+
+    def _encode_file(self, fileobj, mime: str) -> tuple:
+        procesada = _preprocess(fileobj)
+        if procesada is not None:
+            return base64.b64encode(procesada).decode("ascii"), "image/jpeg"
+        # PIL no la abrió: codificar la original por bloques (múltiplos de 3
+        # bytes, así cada bloque en base64 se concatena sin padding intermedio)
+        fileobj.seek(0)
+        bloques = iter(lambda: fileobj.read(_B64_BLOQUE), b"")
+        return "".join(base64.b64encode(b).decode("ascii") for b in bloques), mime
+
     def _encode_image(self, path: str) -> str:
+        # mmap evita copiar la imagen a un buffer de Python antes de codificar
         with open(path, "rb") as f:
-            return base64.b64encode(f.read()).decode()
+            try:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    return base64.b64encode(m).decode("ascii")
+            except ValueError:  # archivo vacío: mmap no admite longitud 0
+                return ""
 
     def _call_api(self, b64: str, mime: str = "image/png") -> dict:
-        response = self.client.chat.completions.create(
-            model="gpt-4o-mini",
-            temperature=0,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": _PROMPT},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:{mime};base64,{b64}"
-                            },
-                        },
-                    ],
-                }
-            ],
-            response_format={"type": "json_object"},
+        response = self.client.chat.completions.create(**_request_kwargs(b64, mime))
+        return orjson.loads(response.choices[0].message.content)
+
+    async def _call_api_async(self, b64: str, mime: str = "image/png") -> dict:
+        response = await self.async_client.chat.completions.create(
+            **_request_kwargs(b64, mime)
         )
-        return json.loads(response.choices[0].message.content)
+        return orjson.loads(response.choices[0].message.content)
 
     # ------------------------------------------------------------------
     # Interno — mapeo al modelo Bill
@@ -137,45 +204,103 @@ class CFEVisionExtractor:
         coinciden con los campos de BillForm + campos extra del dashboard.
         Incluye periodo_inicio y periodo_fin parseados desde periodo_facturado.
         """
-        periodo_inicio, periodo_fin = _parse_periodo(raw.get("periodo_facturado"))
+        out = {key: conv(raw.get(raw_key)) for key, raw_key, conv in _FIELD_SPEC}
 
         tarifa_raw = raw.get("tarifa")
-        tarifa = _normalize_tarifa(tarifa_raw) if tarifa_raw else None
-
-        return {
-            # --- Campos originales (BillForm) ---
-            "consumo_kwh": _safe_int(raw.get("consumo_total")),
-            "lectura_anterior": _safe_int(raw.get("lectura_anterior")),
-            "lectura_actual": _safe_int(raw.get("lectura_actual")),
-            "total_recibo_mxn": _safe_float(raw.get("total_pagar")),
-            "tarifa": tarifa,
-            "subsidio_mxn": _safe_float(raw.get("subsidio")),
-            "multiplicador": _safe_int(raw.get("multiplicador")) or 1,
-            "periodo_inicio": periodo_inicio,  # "YYYY-MM-DD" o None
-            "periodo_fin": periodo_fin,        # "YYYY-MM-DD" o None
-
-            # --- Campos de escalones tarifarios (dashboard) ---
-            "periodo_basico_kwh": _safe_int(raw.get("periodo_basico_kwh")),
-            "periodo_intermedio_kwh": _safe_int(raw.get("periodo_intermedio_kwh")),
-            "periodo_excedente_kwh": _safe_int(raw.get("periodo_excedente_kwh")),
-            "subtotal_basico_mxn": _safe_float(raw.get("subtotal_basico_mxn")),
-            "subtotal_intermedio_mxn": _safe_float(raw.get("subtotal_intermedio_mxn")),
-            "subtotal_excedente_mxn": _safe_float(raw.get("subtotal_excedente_mxn")),
-        }
+        out["tarifa"] = _normalize_tarifa(tarifa_raw) if tarifa_raw else None
+        out["multiplicador"] = out["multiplicador"] or 1
+        # "YYYY-MM-DD" o None
+        out["periodo_inicio"], out["periodo_fin"] = _parse_periodo(
+            raw.get("periodo_facturado")
+        )
+        return out
 
 
 # ----------------------------------------------------------------------
 # Funciones auxiliares (módulo-level para facilitar el testing)
 # ----------------------------------------------------------------------
 
+@lru_cache(maxsize=None)
+def _get_client(api_key: str) -> OpenAI:
+    """Un cliente por clave: se reusa su pool HTTP (keep-alive) entre requests."""
+    return OpenAI(api_key=api_key)
+
+
+def _request_kwargs(b64: str, mime: str) -> dict:
+    """Parámetros de chat.completions.create (compartidos por sync y async)."""
+    return {
+        "model": "gpt-4o-mini",
+        "temperature": 0,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": _PROMPT},
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:{mime};base64,{b64}"
+                        },
+                    },
+                ],
+            }
+        ],
+        "response_format": {"type": "json_object"},
+    }
+
+
+# El modelo de visión trabaja con tiles de ~768 px: no tiene caso mandar
+# fotos de 4000×3000 (más bytes de subida y más tokens de imagen).
+_MAX_LADO_PX = 1600
+_JPEG_QUALITY = 85
+
+# Bloque de lectura al codificar un archivo sin procesar (múltiplo de 3)
+_B64_BLOQUE = 3 * 64 * 1024
+
+
+def _preprocess(fuente) -> Optional[bytes]:
+    """
+    Endereza la imagen según EXIF, la reduce a _MAX_LADO_PX por lado y la
+    recomprime como JPEG sin metadatos.  `fuente` es una ruta o un archivo
+    binario.  Retorna None si PIL no puede abrirla.
+    """
+    try:
+        with Image.open(fuente) as img:
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((_MAX_LADO_PX, _MAX_LADO_PX), Image.Resampling.LANCZOS)
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            buf = io.BytesIO()
+            img.save(buf, format="JPEG", quality=_JPEG_QUALITY, optimize=True)
+    except (OSError, Image.DecompressionBombError):
+        return None
+    return buf.getvalue()
+
+
 _TARIFA_VALIDAS = {"1", "1A", "1B", "1C", "1D", "1E", "1F", "DAC"}
 
+_TARIFA_PREFIX_RE = re.compile(r"^TARIFA\s*")
+# El guión como separador requiere espacios a ambos lados (" - ")
+# para no confundirse con guiones dentro de fechas como "01-12-2024".
+_PERIODO_SPLIT_RE = re.compile(r"\s+(?:-|al|a)\s+")
+# dd/mm/yyyy, dd-mm-yyyy, yyyy-mm-dd, dd/mm/yy, dd-mm-yy (mismo separador)
+_DATE_RE = re.compile(r"^(\d{1,4})([/-])(\d{1,2})\2(\d{1,4})$")
+
+_FORMATOS_FECHA = (
+    "%d/%m/%Y",
+    "%d-%m-%Y",
+    "%Y-%m-%d",
+    "%d/%m/%y",
+    "%d-%m-%y",
+)
+
 
+@lru_cache(maxsize=64)
 def _normalize_tarifa(valor: str) -> Optional[str]:
     """Normaliza el valor de tarifa al formato esperado por el modelo."""
     limpio = valor.strip().upper()
     # Quita prefijos como "TARIFA " que puede dejar el modelo
-    limpio = re.sub(r"^TARIFA\s*", "", limpio)
+    limpio = _TARIFA_PREFIX_RE.sub("", limpio)
     if limpio in _TARIFA_VALIDAS:
         return limpio
     return None  # No reconocida → el form quedará vacío en ese campo
@@ -193,9 +318,7 @@ def _parse_periodo(texto: Optional[str]) -> tuple:
         return None, None
 
     # Intentar separar en dos fechas.
-    # El guión como separador requiere espacios a ambos lados (" - ")
-    # para no confundirse con guiones dentro de fechas como "01-12-2024".
-    partes = re.split(r"\s+(?:-|al|a)\s+", texto.strip(), maxsplit=1)
+    partes = _PERIODO_SPLIT_RE.split(texto.strip(), maxsplit=1)
     if len(partes) != 2:
         return None, None
 
@@ -206,14 +329,24 @@ def _parse_periodo(texto: Optional[str]) -> tuple:
 
 def _parse_fecha(texto: str) -> Optional[str]:
     """Intenta parsear una fecha en varios formatos y retorna ISO (YYYY-MM-DD)."""
-    formatos = [
-        "%d/%m/%Y",
-        "%d-%m-%Y",
-        "%Y-%m-%d",
-        "%d/%m/%y",
-        "%d-%m-%y",
-    ]
-    for fmt in formatos:
+    m = _DATE_RE.match(texto)
+    if m:
+        a, sep, mes, c = m.groups()
+        try:
+            if len(a) == 4 and sep == "-" and len(c) <= 2:
+                return date(int(a), int(mes), int(c)).isoformat()
+            if len(a) <= 2 and len(c) == 4:
+                return date(int(c), int(mes), int(a)).isoformat()
+            if len(a) <= 2 and len(c) == 2:
+                # Mismo pivote que %y: 69-99 → 19xx, 00-68 → 20xx
+                anio = int(c)
+                anio += 1900 if anio >= 69 else 2000
+                return date(anio, int(mes), int(a)).isoformat()
+        except ValueError:
+            return None
+
+    # Formatos raros: se conserva el intento con strptime
+    for fmt in _FORMATOS_FECHA:
         try:
             dt = datetime.strptime(texto, fmt)
             return dt.strftime("%Y-%m-%d")
@@ -226,9 +359,14 @@ def _safe_int(valor) -> Optional[int]:
     """Convierte a int de forma segura; retorna None si no es posible."""
     if valor is None:
         return None
+    # El modo JSON de OpenAI ya devuelve números; solo los strings se parsean
+    if isinstance(valor, int) and not isinstance(valor, bool):
+        return valor
     try:
+        if isinstance(valor, float):
+            return int(valor)
         return int(float(valor))  # maneja "280.0" → 280
-    except (ValueError, TypeError):
+    except (ValueError, TypeError, OverflowError):
         return None
 
 
@@ -236,7 +374,30 @@ def _safe_float(valor) -> Optional[float]:
     """Convierte a float de forma segura; retorna None si no es posible."""
     if valor is None:
         return None
+    if isinstance(valor, float):
+        return round(valor, 2)
     try:
         return round(float(valor), 2)
-    except (ValueError, TypeError):
-        return None
\ No newline at end of file
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+
+# (clave en Bill/BillForm, clave en la respuesta OCR, conversión).
+# tarifa y periodo_* se resuelven aparte en _map_to_bill_fields.
+_FIELD_SPEC = (
+    # --- Campos originales (BillForm) ---
+    ("consumo_kwh", "consumo_total", _safe_int),
+    ("lectura_anterior", "lectura_anterior", _safe_int),
+    ("lectura_actual", "lectura_actual", _safe_int),
+    ("total_recibo_mxn", "total_pagar", _safe_float),
+    ("subsidio_mxn", "subsidio", _safe_float),
+    ("multiplicador", "multiplicador", _safe_int),
+
+    # --- Campos de escalones tarifarios (dashboard) ---
+    ("periodo_basico_kwh", "periodo_basico_kwh", _safe_int),
+    ("periodo_intermedio_kwh", "periodo_intermedio_kwh", _safe_int),
+    ("periodo_excedente_kwh", "periodo_excedente_kwh", _safe_int),
+    ("subtotal_basico_mxn", "subtotal_basico_mxn", _safe_float),
+    ("subtotal_intermedio_mxn", "subtotal_intermedio_mxn", _safe_float),
+    ("subtotal_excedente_mxn", "subtotal_excedente_mxn", _safe_float),
+)
@@ -22,12 +22,16 @@ Salida:
 """
 
 import json
+import logging
 import os
-import re
 from typing import Optional
 
-from openai import OpenAI
+from openai import OpenAI, Timeout
 
+from .llm_cache import llm_cache
+
+
+logger = logging.getLogger(__name__)
 
 # ─── Tarifas por kWh (MXN) ──────────────────────────────────────────────────
 TARIFAS = {
@@ -44,105 +48,104 @@ TARIFAS = {
 # Factor CO2e México 2023 (kgCO2e / kWh)
 CO2E_FACTOR = 0.444
 
+# Recomendaciones por recibo; un análisis con menos está incompleto
+NUM_RECS = 5
+
+_MODEL = "gpt-4o-mini"
+# Salida estructurada, no creativa: temperatura 0 → mismo prompt, misma
+# respuesta (la cache por prompt exacto es válida y los tests reproducibles)
+_TEMPERATURE = 0
+
+
+# Esquema de una recomendación para Structured Outputs: la API garantiza
+# JSON válido con estos campos, sin texto extra ni ```.
+_REC_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "titulo": {"type": "string"},
+        "descripcion": {"type": "string"},
+        "tipo": {"type": "string", "enum": ["sin_inversion", "con_inversion"]},
+        "ahorro_mensual_mxn": {"type": "number"},
+        "ahorro_anual_mxn": {"type": "number"},
+        "reduccion_co2_kg_anual": {"type": "number"},
+        "costo_inversion_mxn": {"type": ["number", "null"]},
+        "retorno_meses": {"type": ["integer", "null"]},
+        "prioridad": {"type": "integer"},
+    },
+    "required": [
+        "titulo", "descripcion", "tipo", "ahorro_mensual_mxn", "ahorro_anual_mxn",
+        "reduccion_co2_kg_anual", "costo_inversion_mxn", "retorno_meses", "prioridad",
+    ],
+    "additionalProperties": False,
+}
+
+
+def _json_schema_format(nombre: str, clave: str, items: dict) -> dict:
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": nombre,
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {clave: {"type": "array", "items": items}},
+                "required": [clave],
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+_RESPONSE_FORMAT = _json_schema_format("recomendaciones", "recomendaciones", _REC_SCHEMA)
+_BATCH_RESPONSE_FORMAT = _json_schema_format(
+    "recomendaciones_por_recibo", "recibos", {"type": "array", "items": _REC_SCHEMA}
+)
+
+# Respuestas que no aportan información al prompt
+_VALORES_NEGATIVOS = ("no", "", "0", [], None)
+
+# Cliente compartido entre requests: reusa el pool HTTPS (keep-alive)
+_client: Optional[OpenAI] = None
+
+
+def _get_client() -> OpenAI:
+    """Crea el cliente de OpenAI la primera vez que se necesita."""
+    global _client
+    if _client is None:
+        api_key = os.environ.get("OPENAI_API_KEY")
+        if not api_key:
+            raise RuntimeError("OPENAI_API_KEY no configurada en variables de entorno.")
+        _client = OpenAI(
+            api_key=api_key,
+            # Generar 5 recomendaciones puede tardar; la conexión no debería
+            timeout=Timeout(60.0, connect=5.0),
+            max_retries=2,
+        )
+    return _client
+
 
 def _precio_kwh(tarifa: str) -> float:
     """Retorna precio $/kWh según tarifa. Si no se conoce, usa promedio."""
-    return TARIFAS.get(tarifa.upper().replace("TARIFA ", ""), 1.47)
+    # Camino común: Bill.tarifa ya es la clave ("1C", "DAC"), sin copias
+    precio = TARIFAS.get(tarifa)
+    if precio is None:
+        precio = TARIFAS.get(tarifa.upper().replace("TARIFA ", ""), 1.47)
+    return precio
 
 
-def _build_prompt(respuestas: dict, tarifa: str, consumo_kwh: int) -> str:
-    """
-    Construye el prompt que le mandamos a OpenAI.
-    Incluye todas las respuestas de forma legible y las instrucciones
-    estrictas de formato de salida.
-    """
-    precio = _precio_kwh(tarifa)
-
-    # ─── Resumen legible de respuestas ──────────────────────────────────
-    lines = []
-
-    # 1. Cambios recientes
-    cambios = respuestas.get("cambios_recientes", [])
-    lines.append(f"Cambios recientes en el hogar: {', '.join(cambios) if cambios else 'Ninguno reportado'}")
-
-    # 2. A/C
-    ac = respuestas.get("tiene_ac", "no")
-    lines.append(f"Aire acondicionado: {ac}")
-    if ac not in ("no",):
-        lines.append(f"  Unidades de A/C: {respuestas.get('ac_unidades', '?')}")
-        lines.append(f"  Días/semana en uso: {respuestas.get('ac_dias_semana', '?')}")
-        lines.append(f"  Horas/día promedio: {respuestas.get('ac_horas_dia', '?')}")
-        lines.append(f"  Temperatura configurada: {respuestas.get('ac_temperatura', '?')}°C")
-
-    # 3. Agua caliente
-    agua_tipo = respuestas.get("agua_caliente_tipo", "gas")
-    lines.append(f"Calentamiento de agua: {agua_tipo}")
-    if agua_tipo in ("electrico", "mixto"):
-        lines.append(f"  Equipo: {respuestas.get('agua_caliente_equipo', [])}")
-        lines.append(f"  Personas que se bañan/día: {respuestas.get('agua_personas', '?')}")
-        lines.append(f"  Duración promedio baño: {respuestas.get('agua_duracion', '?')} min")
-
-    # 4. Refrigeración
-    lines.append(f"Refrigeradores: {respuestas.get('refrigeradores', '1')}")
-    lines.append(f"Antigüedad del principal: {respuestas.get('ref_antiguedad', 'no_se')}")
-
-    # 5. Secadora
-    secadora = respuestas.get("tiene_secadora", "no")
-    lines.append(f"Secadora: {secadora}")
-    if secadora == "electrica":
-        lines.append(f"  Cargas/semana: {respuestas.get('secadora_cargas', '?')}")
-        lines.append(f"  Usa alto calor: {respuestas.get('secadora_alto_calor', '?')}")
-
-    # 6. Bombas
-    bomba = respuestas.get("tiene_bomba", "no")
-    lines.append(f"Bomba de agua: {bomba}")
-    if bomba == "si":
-        lines.append(f"  Frecuencia: {respuestas.get('bomba_frecuencia', '?')}")
-    bomba_alberca = respuestas.get("tiene_bomba_alberca", "no")
-    lines.append(f"Bomba de alberca: {bomba_alberca}")
-    if bomba_alberca == "si":
-        lines.append(f"  Horas/día: {respuestas.get('bomba_alberca_horas', '?')}")
-
-    # 7. Calefactor
-    calef = respuestas.get("calefactor", "no")
-    lines.append(f"Calefactor eléctrico: {calef}")
-    if calef in ("ocasional", "frecuente"):
-        lines.append(f"  Horas/día en días de uso: {respuestas.get('calefactor_horas', '?')}")
-
-    # 8. Cocina
-    lines.append(f"Cocina: {respuestas.get('cocina_tipo', 'gas')}")
-    lines.append(f"  Horno eléctrico: {respuestas.get('cocina_horno', 'no')}")
-    lines.append(f"  Airfryer: {respuestas.get('cocina_airfryer', 'no')}")
-    lines.append(f"  Parrilla eléctrica: {respuestas.get('cocina_parrilla', 'no')}")
-    lines.append(f"  Hervidor eléctrico: {respuestas.get('cocina_hervidor', 'no')}")
-
-    # 9. Siempre encendidos
-    lines.append(f"TVs en uso diario: {respuestas.get('tvs', '0')}")
-    lines.append(f"PC/laptop uso diario: {respuestas.get('pc_uso', 'no')}")
-    lines.append(f"Consola de videojuegos: {respuestas.get('consola', 'no')}")
-    lines.append(f"Dispositivos 24/7: {respuestas.get('siempre_encendidos', [])}")
-
-    # 10. Culpables ocultos
-    culpables = respuestas.get("culpables_ocultos", [])
-    lines.append(f"Otros aparatos: {', '.join(culpables) if culpables else 'Ninguno'}")
-    if culpables:
-        lines.append(f"  Uso típico: {respuestas.get('culpables_uso', '?')}")
-
-    resumen = "\n".join(lines)
-
-    prompt = f"""Eres un experto en eficiencia energética doméstica en México.
+# Instrucciones fijas: van en el mensaje de sistema y son idénticas en cada
+# llamada, así OpenAI puede reutilizar el prefijo cacheado del prompt.
+# Lo que depende del usuario (tarifa, precio, consumo, respuestas) va aparte.
+_SYSTEM_PROMPT = f"""Eres un experto en eficiencia energética doméstica en México.
 Un usuario ha respondido una encuesta sobre su consumo eléctrico. Basándote ÚNICAMENTE en sus respuestas, genera exactamente 5 recomendaciones personalizadas para reducir su consumo y su impacto ambiental.
 
-═══════════════════════════════════════
-DATOS DEL USUARIO
-═══════════════════════════════════════
-Tarifa CFE: {tarifa}
-Precio del kWh según su tarifa: ${precio:.3f} MXN/kWh
-Consumo del periodo: {consumo_kwh} kWh
 Factor de emisiones de CO₂e en México: {CO2E_FACTOR} kg CO₂e por kWh consumido
 
-Respuestas de la encuesta:
-{resumen}
+Leyenda de las respuestas: una por línea como clave=valor (listas separadas por coma).
+Toda clave omitida vale "no" / 0 / ninguno.  Rangos: ac_dias_semana en días/semana;
+ac_horas_dia, bomba_alberca_horas, calefactor_horas, pc_uso, consola y culpables_uso en h/día;
+ac_temperatura en °C; agua_personas en personas que se bañan/día; agua_duracion en min por baño;
+secadora_cargas en cargas/semana; cocina_horno, cocina_airfryer y cocina_hervidor en veces/semana.
 
 ═══════════════════════════════════════
 INSTRUCCIONES ESTRICTAS
@@ -155,7 +158,7 @@ INSTRUCCIONES ESTRICTAS
    Si el usuario NO tiene A/C, NO generes recomendaciones sobre A/C.
    Si el usuario NO tiene secadora eléctrica, NO generes recomendaciones sobre secadora. Etc.
 4. Para el beneficio económico, CALCULA:
-   - ahorro_mensual_mxn: estimación de cuánto se ahorra por mes en MXN, usando el precio del kWh de su tarifa (${precio:.3f}/kWh).
+   - ahorro_mensual_mxn: estimación de cuánto se ahorra por mes en MXN, usando el precio del kWh de su tarifa (indicado en los datos del usuario).
    - ahorro_anual_mxn: ahorro_mensual_mxn × 12.
 5. Para el impacto ambiental, CALCULA:
    - reduccion_co2_kg_anual: los kWh ahorrados por año × {CO2E_FACTOR} (factor de emisiones México).
@@ -168,10 +171,9 @@ INSTRUCCIONES ESTRICTAS
 ═══════════════════════════════════════
 FORMATO DE SALIDA
 ═══════════════════════════════════════
-Devuelve ÚNICAMENTE un JSON válido (sin texto extra, sin markdown, sin ```). 
-Estructura exacta:
+Devuelve un objeto JSON con esta estructura exacta:
 
-[
+{{"recomendaciones": [
   {{
     "titulo": "Título corto y descriptivo",
     "descripcion": "Descripción práctica de qué hacer exactamente (2-3 oraciones).",
@@ -184,9 +186,43 @@ Estructura exacta:
     "prioridad": <1 al 5>
   }},
   ...
-]
+]}}
+"""
+
+
+def _build_prompt(respuestas: dict, tarifa: str, consumo_kwh: int) -> list:
+    """
+    Construye los mensajes que le mandamos a OpenAI: el system prompt fijo
+    (rol, instrucciones y formato) y un mensaje de usuario con sus datos
+    y sus respuestas en formato compacto `clave=valor`.
+    """
+    precio = _precio_kwh(tarifa)
+
+    # ─── Resumen compacto: solo respuestas con señal ────────────────────
+    # Las secciones condicionales ya vienen recortadas por la encuesta;
+    # aquí además se omiten los "no"/vacíos (la leyenda del system prompt
+    # indica que lo omitido vale no/0/ninguno).
+    lines = [
+        f"{clave}={','.join(valor) if isinstance(valor, list) else valor}"
+        for clave, valor in respuestas.items()
+        if valor not in _VALORES_NEGATIVOS
+    ]
+    resumen = "\n".join(lines) or "(todo en no/ninguno)"
+
+    user_content = f"""═══════════════════════════════════════
+DATOS DEL USUARIO
+═══════════════════════════════════════
+Tarifa CFE: {tarifa}
+Precio del kWh según su tarifa: ${precio:.3f} MXN/kWh
+Consumo del periodo: {consumo_kwh} kWh
+
+Respuestas de la encuesta:
+{resumen}
 """
-    return prompt
+    return [
+        {"role": "system", "content": _SYSTEM_PROMPT},
+        {"role": "user", "content": user_content},
+    ]
 
 
 def get_recommendations(respuestas: dict, tarifa: str, consumo_kwh: int) -> list:
@@ -194,45 +230,126 @@ def get_recommendations(respuestas: dict, tarifa: str, consumo_kwh: int) -> list
     Llama a OpenAI y retorna las 5 recomendaciones parseadas.
     En caso de error retorna una lista vacía.
     """
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("OPENAI_API_KEY no configurada en variables de entorno.")
-
-    client = OpenAI(api_key=api_key)
-    prompt = _build_prompt(respuestas, tarifa, consumo_kwh)
-
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        temperature=0.3,
+    messages = _build_prompt(respuestas, tarifa, consumo_kwh)
+
+    # Mismo prompt → misma respuesta: evita la llamada (y su costo)
+    cache_key = llm_cache.cache_key(_MODEL, messages, _TEMPERATURE)
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # stream=True: cada recomendación se valida en cuanto se cierra su objeto
+    # y con 5 completas se corta, sin esperar al resto de la generación.
+    stream = _get_client().chat.completions.create(
+        model=_MODEL,
+        temperature=_TEMPERATURE,
         max_tokens=2000,
-        messages=[
-            {"role": "user", "content": prompt}
-        ],
+        messages=messages,
+        response_format=_RESPONSE_FORMAT,
+        stream=True,
     )
 
-    raw = response.choices[0].message.content.strip()
+    parser = _ArrayObjectParser()
+    cleaned = []
+    for chunk in stream:
+        if chunk.choices:
+            _feed_recs(parser, chunk.choices[0].delta.content, cleaned)
+        if len(cleaned) == NUM_RECS:
+            stream.close()
+            break
+
+    if cleaned:
+        llm_cache.set(cache_key, cleaned)
+    return cleaned
+
 
-    # Quitar posibles ```json ... ``` que el modelo a veces agrega
-    raw = re.sub(r"^```(?:json)?\s*", "", raw)
-    raw = re.sub(r"\s*```$", "", raw)
+def get_recommendations_batch(jobs: list) -> list:
+    """
+    Recomendaciones para varios recibos en UNA llamada a OpenAI.
 
+    `jobs` es una lista de tuplas (respuestas, tarifa, consumo_kwh); retorna
+    una lista de recomendaciones por job, en el mismo orden.  Los jobs ya
+    cacheados no se reenvían.  Si la respuesta combinada no trae un
+    resultado por recibo, se cae a una llamada por job.
+    """
+    if len(jobs) <= 1:
+        return [get_recommendations(*job) for job in jobs]
+
+    resultados = [None] * len(jobs)
+    pendientes = []  # (índice, cache_key, mensaje de usuario)
+    for i, job in enumerate(jobs):
+        messages = _build_prompt(*job)
+        cache_key = llm_cache.cache_key(_MODEL, messages, _TEMPERATURE)
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            resultados[i] = cached
+        else:
+            pendientes.append((i, cache_key, messages[1]["content"]))
+
+    if len(pendientes) == 1:
+        i = pendientes[0][0]
+        resultados[i] = get_recommendations(*jobs[i])
+    elif pendientes:
+        bloques = "\n".join(
+            f"### RECIBO {n}\n{contenido}"
+            for n, (_, _, contenido) in enumerate(pendientes, start=1)
+        )
+        client = _get_client()
+        response = client.chat.completions.create(
+            model=_MODEL,
+            temperature=_TEMPERATURE,
+            max_tokens=2000 * len(pendientes),
+            messages=[
+                {"role": "system", "content": _SYSTEM_PROMPT},
+                {"role": "user", "content": (
+                    f"Hay {len(pendientes)} usuarios distintos, separados por '### RECIBO n'. "
+                    "Aplica las instrucciones a cada uno por separado y devuelve un objeto "
+                    f'{{"recibos": [...]}} con {len(pendientes)} listas de recomendaciones, '
+                    "una por recibo y en el mismo orden.\n\n"
+                    + bloques
+                )},
+            ],
+            response_format=_BATCH_RESPONSE_FORMAT,
+        )
+        _log_cached_tokens(response)
+        lotes = _parse_response(response.choices[0].message.content, "recibos")
+
+        if lotes is None or len(lotes) != len(pendientes) or not all(isinstance(x, list) for x in lotes):
+            for i, _, _ in pendientes:
+                resultados[i] = get_recommendations(*jobs[i])
+        else:
+            for (i, cache_key, _), recs in zip(pendientes, lotes):
+                cleaned = _clean_recs(recs)
+                if cleaned:
+                    llm_cache.set(cache_key, cleaned)
+                resultados[i] = cleaned
+
+    return resultados
+
+
+def _parse_response(raw: str, clave: str) -> Optional[list]:
+    """
+    Extrae la lista `clave` del objeto JSON que devuelve el modelo.
+    Con Structured Outputs el JSON siempre es válido salvo que la respuesta
+    se corte por max_tokens; en ese caso (o si no hay lista) retorna None.
+    """
     try:
-        recs = json.loads(raw)
+        data = json.loads(raw)
     except json.JSONDecodeError:
-        # Intento de recuperación: buscar el primer [ ... ] en el texto
-        match = re.search(r"\[.*\]", raw, re.DOTALL)
-        if match:
-            recs = json.loads(match.group())
-        else:
-            return []
+        return None
+    if isinstance(data, dict):
+        data = data.get(clave)
+    if not isinstance(data, list):
+        return None
+    return data
 
-    # Validación básica: debe ser lista de 5 dicts
-    if not isinstance(recs, list):
-        return []
 
-    # Asegurar campos requeridos y tipos
+def _clean_recs(recs: list) -> list:
+    """Asegura campos requeridos y tipos (máximo 5 recomendaciones)."""
     cleaned = []
-    for i, r in enumerate(recs[:5]):  # máximo 5
+    for i, r in enumerate(recs[:NUM_RECS]):
+        if not isinstance(r, dict):
+            continue
         cleaned.append({
             "titulo": str(r.get("titulo", "Sin título")),
             "descripcion": str(r.get("descripcion", "")),
@@ -244,5 +361,83 @@ def get_recommendations(respuestas: dict, tarifa: str, consumo_kwh: int) -> list
             "retorno_meses": int(r["retorno_meses"]) if r.get("retorno_meses") else None,
             "prioridad": int(r.get("prioridad", i + 1)),
         })
+    return cleaned
+
+
+def _log_cached_tokens(response) -> None:
+    """Registra cuántos tokens del prompt salieron de la cache de OpenAI."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    logger.info(
+        "OpenAI prompt_tokens=%s cached_tokens=%s",
+        usage.prompt_tokens,
+        getattr(details, "cached_tokens", 0) or 0,
+    )
+
+
+def _feed_recs(parser, content: Optional[str], cleaned: list) -> list:
+    """
+    Pasa un pedazo del stream al parser y agrega a `cleaned` (máximo 5) las
+    recomendaciones que se completaron, ya limpias.  Retorna las nuevas.
+    """
+    nuevas = []
+    for obj in parser.feed(content or ""):
+        if len(cleaned) == NUM_RECS:
+            break
+        rec = _clean_recs([obj])
+        if rec:
+            if "prioridad" not in obj:
+                rec[0]["prioridad"] = len(cleaned) + 1
+            cleaned.append(rec[0])
+            nuevas.append(rec[0])
+    return nuevas
+
+
+class _ArrayObjectParser:
+    """
+    Parser incremental mínimo: recibe el texto por pedazos y retorna los
+    objetos del primer arreglo JSON conforme se completan (el arreglo puede
+    venir suelto o dentro de {"recomendaciones": [...]}).
+    """
 
-    return cleaned
\ No newline at end of file
+    def __init__(self):
+        self.text = ""
+        self.pos = 0
+        self.depth = 0
+        self.array_depth = None  # profundidad dentro del primer arreglo
+        self.start = None
+        self.in_str = False
+        self.esc = False
+
+    def feed(self, chunk: str) -> list:
+        self.text += chunk
+        objetos = []
+        for i in range(self.pos, len(self.text)):
+            c = self.text[i]
+            if self.in_str:
+                if self.esc:
+                    self.esc = False
+                elif c == "\\":
+                    self.esc = True
+                elif c == '"':
+                    self.in_str = False
+            elif c == '"':
+                self.in_str = True
+            elif c in "[{":
+                self.depth += 1
+                if c == "[" and self.array_depth is None:
+                    self.array_depth = self.depth
+                elif c == "{" and self.array_depth is not None and self.depth == self.array_depth + 1:
+                    self.start = i
+            elif c in "]}":
+                if c == "}" and self.start is not None and self.depth == self.array_depth + 1:
+                    try:
+                        objetos.append(json.loads(self.text[self.start:i + 1]))
+                    except json.JSONDecodeError:
+                        pass
+                    self.start = None
+                self.depth -= 1
+        self.pos = len(self.text)
+        return objetos
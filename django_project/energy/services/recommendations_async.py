@@ -0,0 +1,134 @@
+"""
+Versión async del servicio de recomendaciones (AsyncOpenAI).
+
+Misma entrada/salida que `recommendations.get_recommendations` y el mismo
+cache de respuestas; la espera de OpenAI no ocupa el hilo del worker y
+varias encuestas se pueden resolver en paralelo con
+`get_recommendations_many_async`.  `stream_recommendations_async` entrega
+cada recomendación en cuanto el modelo termina de escribirla.
+"""
+
+import asyncio
+import os
+import weakref
+from typing import AsyncIterator
+
+from openai import AsyncOpenAI, Timeout
+
+from .llm_cache import llm_cache
+from .recommendations import (
+    _MODEL,
+    _RESPONSE_FORMAT,
+    _TEMPERATURE,
+    _ArrayObjectParser,
+    _build_prompt,
+    _clean_recs,
+    _feed_recs,
+    _parse_response,
+)
+
+
+# Máximo de llamadas simultáneas a OpenAI (límite de rate)
+_MAX_CONCURRENCIA = 10
+
+# Un cliente por event loop: el pool de conexiones de httpx queda atado al
+# loop, y bajo WSGI cada request async corre en un loop nuevo.
+_clients = weakref.WeakKeyDictionary()
+
+
+def _get_client() -> AsyncOpenAI:
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        api_key = os.environ.get("OPENAI_API_KEY")
+        if not api_key:
+            raise RuntimeError("OPENAI_API_KEY no configurada en variables de entorno.")
+        client = AsyncOpenAI(
+            api_key=api_key,
+            timeout=Timeout(60.0, connect=5.0),
+            max_retries=2,
+        )
+        _clients[loop] = client
+    return client
+
+
+async def get_recommendations_async(respuestas: dict, tarifa: str, consumo_kwh: int) -> list:
+    """
+    Llama a OpenAI sin bloquear y retorna las 5 recomendaciones parseadas.
+    En caso de error de parseo retorna una lista vacía.
+    """
+    messages = _build_prompt(respuestas, tarifa, consumo_kwh)
+
+    cache_key = llm_cache.cache_key(_MODEL, messages, _TEMPERATURE)
+    cached = await llm_cache.aget(cache_key)
+    if cached is not None:
+        return cached
+
+    response = await _get_client().chat.completions.create(
+        model=_MODEL,
+        temperature=_TEMPERATURE,
+        max_tokens=2000,
+        messages=messages,
+        response_format=_RESPONSE_FORMAT,
+    )
+
+    recs = _parse_response(response.choices[0].message.content, "recomendaciones")
+    if recs is None:
+        return []
+
+    cleaned = _clean_recs(recs)
+    if cleaned:
+        await llm_cache.aset(cache_key, cleaned)
+    return cleaned
+
+
+async def get_recommendations_many_async(jobs: list) -> list:
+    """
+    Resuelve varios (respuestas, tarifa, consumo_kwh) en paralelo, con a lo
+    más _MAX_CONCURRENCIA llamadas en vuelo.  Retorna en el mismo orden.
+    """
+    semaforo = asyncio.Semaphore(_MAX_CONCURRENCIA)
+
+    async def _uno(job):
+        async with semaforo:
+            return await get_recommendations_async(*job)
+
+    return await asyncio.gather(*(_uno(job) for job in jobs))
+
+
+async def stream_recommendations_async(
+    respuestas: dict, tarifa: str, consumo_kwh: int
+) -> AsyncIterator[dict]:
+    """
+    Igual que `get_recommendations_async`, pero con `stream=True`: produce
+    cada recomendación (ya limpia) apenas se cierra su objeto en el JSON.
+    """
+    messages = _build_prompt(respuestas, tarifa, consumo_kwh)
+
+    cache_key = llm_cache.cache_key(_MODEL, messages, _TEMPERATURE)
+    cached = await llm_cache.aget(cache_key)
+    if cached is not None:
+        for rec in cached:
+            yield rec
+        return
+
+    stream = await _get_client().chat.completions.create(
+        model=_MODEL,
+        temperature=_TEMPERATURE,
+        max_tokens=2000,
+        messages=messages,
+        response_format=_RESPONSE_FORMAT,
+        stream=True,
+    )
+
+    parser = _ArrayObjectParser()
+    cleaned = []
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        for rec in _feed_recs(parser, chunk.choices[0].delta.content, cleaned):
+            yield rec
+
+    if cleaned:
+        await llm_cache.aset(cache_key, cleaned)
+
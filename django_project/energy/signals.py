@@ -0,0 +1,63 @@
+"""
+Invalidación de caches derivadas de los modelos.
+"""
+
+import time
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import AnalysisResult, Bill, Survey
+
+
+# Lista de demos de home(); casi nunca cambia
+DEMO_BILLS_CACHE_KEY = 'energy:demo_bills'
+
+# Contexto ya armado de results() por recibo (cache-aside)
+RESULTS_CACHE_TTL = 60 * 60 * 24
+
+
+def results_cache_key(bill_id):
+    return f'energy:results:{bill_id}'
+
+
+# HTML del partial de historial, por lista de ids, guardado junto con la
+# generación con la que se renderizó.  No se pueden borrar todas las claves
+# que mencionan un recibo, así que cada cambio en Bill o AnalysisResult
+# rota la generación y las entradas viejas dejan de ser válidas.  Se lee
+# con un solo get_many (generación + entrada), sin una ida extra a la cache.
+HISTORY_CACHE_TTL = 300
+HISTORY_GEN_KEY = 'energy:history_gen'
+
+
+def history_cache_key(bill_ids):
+    return f"energy:history:{','.join(map(str, bill_ids))}"
+
+
+def invalidate_history():
+    cache.set(HISTORY_GEN_KEY, time.time_ns(), None)
+
+
+def invalidate_demo_bills():
+    cache.delete(DEMO_BILLS_CACHE_KEY)
+
+
+@receiver(post_save, sender=Bill)
+@receiver(post_delete, sender=Bill)
+def _bill_changed(sender, instance, **kwargs):
+    if instance.is_demo:
+        invalidate_demo_bills()
+    cache.delete(results_cache_key(instance.id))
+    if not instance.is_demo:
+        invalidate_history()
+
+
+@receiver(post_save, sender=Survey)
+@receiver(post_delete, sender=Survey)
+@receiver(post_save, sender=AnalysisResult)
+@receiver(post_delete, sender=AnalysisResult)
+def _results_changed(sender, instance, **kwargs):
+    cache.delete(results_cache_key(instance.bill_id))
+    if sender is AnalysisResult:
+        invalidate_history()
@@ -2,9 +2,82 @@
 Tests for the Electric Assistant MVP.
 """
 
+import asyncio
+import base64
+import io
+import sys
+import tempfile
+import threading
+from dataclasses import FrozenInstanceError
+from datetime import date, datetime
 from decimal import Decimal
-from django.test import TestCase
-from .services.calculations import compute_cost_mxn, compute_co2e_kg
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F, Value
+from django.http import QueryDict
+from django.template import Template, engines
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from electric_assistant import settings as project_settings
+from .fields import ORJSONField
+from .forms import BillForm
+from .models import Bill, Survey, AnalysisResult, AnalysisResultManager
+from .services import ocr, recommendations, recommendations_async
+from .services.calculations import (
+    CAT_AC, CAT_HO, CAT_OTROS, CAT_STANDBY, _SCHED_2024,
+    compute_all, compute_breakdown_and_recs, compute_co2e_kg, compute_cost_mxn,
+    compute_rec_totals,
+)
+from .services.ingest import bulk_ingest_bills
+from .services.ocr import (
+    CFEVisionExtractor, _normalize_tarifa, _parse_fecha, _parse_periodo,
+    _preprocess, _safe_float, _safe_int,
+)
+from .services.recommendations import NUM_RECS, _build_prompt, _parse_response, _precio_kwh
+from .services.recommendations_async import _ArrayObjectParser
+from .views import _SURVEY_FIELDS, _generacion_lock_key, _parse_survey_post
+from .views_ocr import _get_extractor
+
+
+_BILL_DEFAULTS = dict(
+    tarifa='1C', periodo_inicio=date(2024, 1, 1),
+    periodo_fin=date(2024, 3, 1), consumo_kwh=280,
+)
+
+
+def _bill(**extra):
+    """Saved 1C bill of 280 kWh for Jan–Mar 2024; `extra` overrides fields."""
+    return Bill.objects.create(**{**_BILL_DEFAULTS, **extra})
+
+
+async def _abill(**extra):
+    """Async version of `_bill`."""
+    return await Bill.objects.acreate(**{**_BILL_DEFAULTS, **extra})
+
+
+# Cache propia de los tests: la de settings es compartida en disco con el
+# servidor de desarrollo y cache.clear() la vaciaría
+_TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=_TEST_CACHES)
+class CacheTestCase(TestCase):
+    """
+    TestCase with an isolated, empty cache.  Use it for anything that reads
+    the cache or saves models (the model signals invalidate cache keys).
+    """
+
+    def setUp(self):
+        cache.clear()
 
 
 class CostCalculationTests(TestCase):
@@ -14,32 +87,41 @@ class CostCalculationTests(TestCase):
         """Test cost for basic consumption (< 150 kWh)."""
         # 100 kWh at basic rate: 100 * 0.98 * 1.16 = 113.68
         cost = compute_cost_mxn(100, '1C')
-        self.assertAlmostEqual(float(cost), 113.68, places=0)
+        self.assertAlmostEqual(cost, 113.68, places=0)
     
     def test_intermediate_consumption(self):
         """Test cost for intermediate consumption (150-280 kWh)."""
         # 200 kWh: 150*0.98 + 50*1.19 = 147 + 59.5 = 206.5 * 1.16 = 239.54
         cost = compute_cost_mxn(200, '1C')
-        self.assertAlmostEqual(float(cost), 239.54, places=0)
+        self.assertAlmostEqual(cost, 239.54, places=0)
     
     def test_excedent_consumption(self):
         """Test cost for excedent consumption (280-500 kWh)."""
         # 350 kWh: 150*0.98 + 130*1.19 + 70*3.52 = 147 + 154.7 + 246.4 = 548.1 * 1.16 = 635.80
         cost = compute_cost_mxn(350, '1C')
-        self.assertAlmostEqual(float(cost), 635.80, places=0)
+        self.assertAlmostEqual(cost, 635.80, places=0)
     
     def test_dac_tariff(self):
         """Test cost for DAC tariff (high rate)."""
         # 300 kWh at DAC: 300 * 6.38 * 1.16 = 2220.24
         cost = compute_cost_mxn(300, 'DAC')
-        self.assertAlmostEqual(float(cost), 2220.24, places=0)
+        self.assertAlmostEqual(cost, 2220.24, places=0)
     
     def test_high_consumption_becomes_dac(self):
         """Test that consumption > 500 kWh uses DAC rate."""
         # 600 kWh: should use DAC rate regardless of declared tariff
         cost = compute_cost_mxn(600, '1C')
         expected = 600 * 6.38 * 1.16  # 4440.48
-        self.assertAlmostEqual(float(cost), expected, places=0)
+        self.assertAlmostEqual(cost, expected, places=0)
+
+
+class TariffScheduleTests(TestCase):
+    """The tariff schedule is an immutable value object."""
+
+    def test_frozen(self):
+        with self.assertRaises(FrozenInstanceError):
+            _SCHED_2024.precio_dac = 1.0
+        self.assertFalse(hasattr(_SCHED_2024, '__dict__'))
 
 
 class CO2CalculationTests(TestCase):
@@ -49,15 +131,1091 @@ class CO2CalculationTests(TestCase):
         """Test CO2e calculation with standard factor."""
         # 100 kWh * 0.444 = 44.4 kg CO2e
         co2e = compute_co2e_kg(100)
-        self.assertEqual(co2e, Decimal('44.40'))
+        self.assertEqual(co2e, 44.4)
     
     def test_co2e_zero(self):
         """Test CO2e for zero consumption."""
         co2e = compute_co2e_kg(0)
-        self.assertEqual(co2e, Decimal('0.00'))
+        self.assertEqual(co2e, 0.0)
     
     def test_co2e_high_consumption(self):
         """Test CO2e for high consumption."""
         # 1000 kWh * 0.444 = 444 kg CO2e
         co2e = compute_co2e_kg(1000)
-        self.assertEqual(co2e, Decimal('444.00'))
+        self.assertEqual(co2e, 444.0)
+
+
+
+class AdminChangelistQueryTests(CacheTestCase):
+    """Los changelists del admin no deben hacer una consulta por fila."""
+
+    def setUp(self):
+        super().setUp()
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        self.client.force_login(admin_user)
+
+    def _crear_bills(self, n):
+        for _ in range(n):
+            bill = _bill()
+            Survey.objects.create(bill=bill, respuestas={'tiene_ac': 'no'})
+            AnalysisResult.objects.create(
+                bill=bill, costo_estimado_mxn=Decimal('100.00'), co2e_kg=Decimal('10.00')
+            )
+
+    def _contar_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def _assert_constante(self, url):
+        self._crear_bills(1)
+        base = self._contar_queries(url)
+        self._crear_bills(4)
+        self.assertEqual(self._contar_queries(url), base)
+
+    def test_survey_changelist(self):
+        self._assert_constante('/admin/energy/survey/')
+
+    def test_analysis_changelist(self):
+        self._assert_constante('/admin/energy/analysisresult/')
+
+    def test_survey_changelist_resumen(self):
+        self._crear_bills(1)
+        response = self.client.get('/admin/energy/survey/')
+        self.assertContains(response, 'A/C: no | Refri: ? | Agua: ? | Secadora: no')
+
+
+def _bill_form_data(**extra):
+    """POST data for a valid BillForm; `extra` overrides fields."""
+    data = {
+        'tarifa': '1C',
+        'periodo_inicio': '2024-01-01',
+        'periodo_fin': '2024-03-01',
+        'consumo_kwh': 280,
+        'multiplicador': 1,
+    }
+    data.update(extra)
+    return data
+
+
+class BillFormTests(TestCase):
+    """Tests for BillForm.clean cross-field validation."""
+
+    def test_escalones_and_lecturas_not_cross_checked(self):
+        """OCR'd tiers and readings that don't add up exactly are still accepted."""
+        form = BillForm(_bill_form_data(
+            periodo_basico_kwh=150, periodo_intermedio_kwh=50,
+            lectura_anterior=1000, lectura_actual=1200,
+        ))
+        self.assertTrue(form.is_valid(), form.errors)
+
+    def test_periodo_fin_after_inicio(self):
+        form = BillForm(_bill_form_data(periodo_fin='2023-12-01'))
+        self.assertFalse(form.is_valid())
+
+
+class CreateBillViewTests(CacheTestCase):
+    """create_bill keeps the recent-bill history in the signed-cookie session."""
+
+    def test_create_bill_history_without_session_table(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/bill/', _bill_form_data())
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse([q for q in ctx.captured_queries if 'django_session' in q['sql']])
+        bill = Bill.objects.get()
+        self.assertEqual(self.client.session['bill_history'], [bill.id])
+
+    def test_session_history_capped_at_five(self):
+        for _ in range(7):
+            self.client.post('/bill/', _bill_form_data())
+        ids = list(Bill.objects.order_by('-id').values_list('id', flat=True))
+        self.assertEqual(self.client.session['bill_history'], ids[:5])
+
+
+class SeedDemoCommandTests(CacheTestCase):
+    """Tests for the seed_demo management command."""
+
+    def test_creates_demo_bills_with_surveys(self):
+        call_command('seed_demo', stdout=StringIO())
+        self.assertEqual(Bill.objects.filter(is_demo=True).count(), 2)
+        self.assertEqual(Survey.objects.filter(bill__is_demo=True).count(), 2)
+
+    def test_rerun_does_not_duplicate(self):
+        call_command('seed_demo', stdout=StringIO())
+        ids = set(Bill.objects.filter(is_demo=True).values_list('id', flat=True))
+        AnalysisResult.objects.create(
+            bill=Bill.objects.filter(is_demo=True).first(),
+            costo_estimado_mxn=Decimal('100.00'),
+            co2e_kg=Decimal('10.00'),
+        )
+        call_command('seed_demo', stdout=StringIO())
+        self.assertEqual(set(Bill.objects.filter(is_demo=True).values_list('id', flat=True)), ids)
+        self.assertEqual(Survey.objects.count(), 2)
+        self.assertEqual(AnalysisResult.objects.count(), 1)
+
+    def test_rerun_removes_stale_demos(self):
+        stale = _bill(tarifa='1', consumo_kwh=99, is_demo=True)
+        Survey.objects.create(bill=stale, respuestas={})
+        call_command('seed_demo', stdout=StringIO())
+        self.assertFalse(Bill.objects.filter(id=stale.id).exists())
+        self.assertEqual(Survey.objects.count(), 2)
+
+
+class BillPropertyTests(TestCase):
+    """Tests for Bill derived amounts."""
+
+    def _bill(self, **extra):
+        return Bill(
+            tarifa='1C',
+            periodo_inicio=date(2024, 1, 1),
+            periodo_fin=date(2024, 3, 1),
+            consumo_kwh=280,
+            **extra,
+        )
+
+    def test_subtotal_iva_dap(self):
+        bill = self._bill(
+            subtotal_basico_mxn=Decimal('147.00'),
+            subtotal_intermedio_mxn=Decimal('154.70'),
+        )
+        self.assertEqual(bill.subtotal_energia, Decimal('301.70'))
+        self.assertEqual(bill.iva, Decimal('48.27'))
+        self.assertEqual(bill.dap, Decimal('15.08'))
+
+    def test_subtotal_without_escalones(self):
+        bill = self._bill()
+        self.assertEqual(bill.subtotal_energia, Decimal('0.00'))
+        self.assertEqual(bill.iva, Decimal('0.00'))
+
+    def test_demanda_max(self):
+        # 280 kWh / 60 días = 4.666… → 4.7
+        self.assertEqual(self._bill().demanda_max, Decimal('4.7'))
+
+    def test_escalones_pct(self):
+        bill = self._bill(periodo_basico_kwh=75)
+        self.assertEqual((bill.basico_pct, bill.intermedio_pct, bill.excedente_pct), (50.0, 0, 0))
+        bill = self._bill(periodo_basico_kwh=150, periodo_intermedio_kwh=130)
+        self.assertEqual((bill.basico_pct, bill.intermedio_pct, bill.excedente_pct), (100.0, 100.0, 0))
+        bill = self._bill(periodo_basico_kwh=150, periodo_intermedio_kwh=60, periodo_excedente_kwh=70)
+        self.assertEqual((bill.basico_pct, bill.intermedio_pct, bill.excedente_pct), (100.0, 100.0, 25.0))
+        self.assertEqual(self._bill().basico_pct, 0)
+
+
+class ORJSONFieldTests(CacheTestCase):
+    """ORJSONField round-trips values through the ORM."""
+
+    def _analysis(self, **extra):
+        bill = _bill()
+        return AnalysisResult.objects.create(
+            bill=bill, costo_estimado_mxn=Decimal('1.00'), co2e_kg=Decimal('1.00'), **extra,
+        )
+
+    def test_round_trip(self):
+        datos = {
+            'lista': [1, 2.5, None, True],
+            'texto': 'Climatización · año ☀',
+            'anidado': {'a': {'b': []}},
+            1: 'llave no-str',
+        }
+        analysis = self._analysis(
+            breakdown_json=datos,
+            recomendaciones_json=[{'titulo': 'Refrigeración'}],
+            supuestos_json={'cuando': datetime(2024, 1, 2, 3, 4, 5)},
+        )
+        analysis.refresh_from_db()
+        self.assertEqual(analysis.breakdown_json, {
+            'lista': [1, 2.5, None, True],
+            'texto': 'Climatización · año ☀',
+            'anidado': {'a': {'b': []}},
+            '1': 'llave no-str',
+        })
+        self.assertEqual(analysis.recomendaciones_json, [{'titulo': 'Refrigeración'}])
+        # orjson serializa datetime en ISO 8601 (la stdlib json lo rechaza)
+        self.assertEqual(analysis.supuestos_json, {'cuando': '2024-01-02T03:04:05'})
+
+    def test_none_is_sql_null(self):
+        analysis = self._analysis(breakdown_json=None)
+        self.assertTrue(AnalysisResult.objects.filter(pk=analysis.pk, breakdown_json__isnull=True).exists())
+        analysis.refresh_from_db()
+        self.assertIsNone(analysis.breakdown_json)
+
+    def test_decimal_rejected(self):
+        # Igual que JSONField sin encoder: Decimal no es serializable
+        with self.assertRaises(TypeError):
+            self._analysis(breakdown_json={'x': Decimal('1.5')})
+
+    def test_expressions_pass_through(self):
+        analysis = self._analysis(supuestos_json={'a': 1})
+        AnalysisResult.objects.filter(pk=analysis.pk).update(breakdown_json=F('supuestos_json'))
+        analysis.refresh_from_db()
+        self.assertEqual(analysis.breakdown_json, {'a': 1})
+        AnalysisResult.objects.filter(pk=analysis.pk).update(
+            breakdown_json=Value({'b': 'ñ'}, output_field=ORJSONField()),
+        )
+        analysis.refresh_from_db()
+        self.assertEqual(analysis.breakdown_json, {'b': 'ñ'})
+        field = AnalysisResult._meta.get_field('breakdown_json')
+        expr = Value({'c': 1}, output_field=ORJSONField())
+        self.assertIs(field.get_db_prep_value(expr, connection), expr)
+
+
+class SurveyInternTests(CacheTestCase):
+    """Survey.respuestas string values are interned on save and load."""
+
+    def test_loaded_values_are_interned(self):
+        bill = _bill()
+        Survey.objects.create(bill=bill, respuestas={
+            'tiene_ac': ''.join(['n', 'o']),
+            'siempre_encendidos': [''.join(['rou', 'ter'])],
+        })
+        respuestas = Survey.objects.get(bill=bill).respuestas
+        self.assertIs(respuestas['tiene_ac'], sys.intern('no'))
+        self.assertIs(respuestas['siempre_encendidos'][0], sys.intern('router'))
+
+
+class AnalysisResultManagerTests(CacheTestCase):
+    """list_view() leaves the JSON columns deferred."""
+
+    def test_list_view_defers_json(self):
+        bill = _bill()
+        AnalysisResult.objects.create(
+            bill=bill, costo_estimado_mxn=Decimal('100.00'), co2e_kg=Decimal('10.00'),
+        )
+        analysis = AnalysisResult.objects.list_view().get()
+        self.assertEqual(
+            analysis.get_deferred_fields(),
+            set(AnalysisResultManager.JSON_FIELDS),
+        )
+
+    def test_save_stores_totals(self):
+        bill = _bill()
+        analysis = AnalysisResult.objects.create(
+            bill=bill, costo_estimado_mxn=Decimal('100.00'), co2e_kg=Decimal('10.00'),
+            recomendaciones_json=[
+                {'ahorro_anual_mxn': 120.5, 'reduccion_co2_kg_anual': 10.1},
+                {'ahorro_anual_mxn': 300, 'reduccion_co2_kg_anual': None},
+            ],
+        )
+        analysis.refresh_from_db()
+        self.assertEqual(analysis.total_ahorro_anual_mxn, Decimal('420.50'))
+        self.assertEqual(analysis.total_co2_kg, Decimal('10.10'))
+
+
+class BillManagerTests(CacheTestCase):
+    """with_details() fetches the 1:1 relations in the same query."""
+
+    def test_with_details_single_query(self):
+        for _ in range(3):
+            bill = _bill()
+            Survey.objects.create(bill=bill, respuestas={'tiene_ac': 'no'})
+            AnalysisResult.objects.create(
+                bill=bill, costo_estimado_mxn=Decimal('100.00'), co2e_kg=Decimal('10.00'),
+            )
+        with self.assertNumQueries(1):
+            for bill in Bill.objects.with_details():
+                bill.survey.respuestas
+                bill.analysis.costo_estimado_mxn
+
+    def test_results_view_single_query(self):
+        bill = _bill()
+        Survey.objects.create(bill=bill, respuestas={'tiene_ac': 'no'})
+        AnalysisResult.objects.create(
+            bill=bill, costo_estimado_mxn=Decimal('100.00'), co2e_kg=Decimal('10.00'),
+            recomendaciones_json=[{'tipo': 'sin_inversion', 'ahorro_anual_mxn': 120}],
+        )
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/results/{bill.id}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_results_view_cache_aside(self):
+        bill = _bill()
+        Survey.objects.create(bill=bill, respuestas={'tiene_ac': 'no'})
+        analysis = AnalysisResult.objects.create(
+            bill=bill, costo_estimado_mxn=Decimal('100.00'), co2e_kg=Decimal('10.00'),
+            recomendaciones_json=[{'titulo': 'LED', 'tipo': 'sin_inversion'}],
+        )
+        self.client.get(f'/results/{bill.id}/')
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(f'/results/{bill.id}/'), 'LED')
+        analysis.recomendaciones_json = [{'titulo': 'Boiler solar', 'tipo': 'con_inversion'}]
+        analysis.save()
+        self.assertContains(self.client.get(f'/results/{bill.id}/'), 'Boiler solar')
+
+    def test_load_demo_and_dashboard_single_query(self):
+        bill = _bill(is_demo=True)
+        Survey.objects.create(bill=bill, respuestas={'tiene_ac': 'no'})
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/demo/{bill.id}/')
+        self.assertRedirects(response, f'/results/{bill.id}/', fetch_redirect_response=False)
+        # El dashboard no toca survey/analysis: sin JOIN extra, y con only()
+        # ninguna propiedad debe cargar una columna diferida
+        Bill.objects.filter(id=bill.id).update(
+            total_recibo_mxn=Decimal('500.00'), subsidio_mxn=Decimal('80.00'),
+            periodo_basico_kwh=150, periodo_intermedio_kwh=130,
+            subtotal_basico_mxn=Decimal('120.00'), subtotal_intermedio_mxn=Decimal('150.00'),
+        )
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/dashboard/{bill.id}/')
+        self.assertContains(response, '500')
+
+
+class NormalizeTarifaTests(TestCase):
+    """Tests for the OCR tariff normalization helper."""
+
+    def test_strips_prefix_and_caches(self):
+        _normalize_tarifa.cache_clear()
+        self.assertEqual(_normalize_tarifa(' tarifa 1c '), '1C')
+        self.assertEqual(_normalize_tarifa(' tarifa 1c '), '1C')
+        self.assertIsNone(_normalize_tarifa('XYZ'))
+        self.assertEqual(_normalize_tarifa.cache_info().hits, 1)
+
+
+class ParsePeriodoTests(TestCase):
+    """Tests for the OCR billing period parser."""
+
+    def test_supported_formats(self):
+        self.assertEqual(
+            _parse_periodo('01/12/2024 - 31/01/2025'), ('2024-12-01', '2025-01-31')
+        )
+        self.assertEqual(
+            _parse_periodo('2024-12-01 al 2025-01-31'), ('2024-12-01', '2025-01-31')
+        )
+        self.assertEqual(
+            _parse_periodo('1-12-24 a 31-1-25'), ('2024-12-01', '2025-01-31')
+        )
+
+    def test_invalid_dates(self):
+        self.assertIsNone(_parse_fecha('31/02/2025'))
+        self.assertIsNone(_parse_fecha('diciembre'))
+        self.assertEqual(_parse_periodo('sin periodo'), (None, None))
+
+
+class MapToBillFieldsTests(TestCase):
+    """Tests for mapping the raw OCR response to Bill fields."""
+
+    def test_mapping(self):
+        extractor = CFEVisionExtractor.__new__(CFEVisionExtractor)
+        out = extractor._map_to_bill_fields({
+            'consumo_total': 350,
+            'lectura_anterior': '1200.0',
+            'total_pagar': 812.456,
+            'tarifa': 'TARIFA 1C',
+            'multiplicador': None,
+            'periodo_facturado': '01/12/2024 - 31/01/2025',
+            'subtotal_basico_mxn': 'n/a',
+        })
+        self.assertEqual(out['consumo_kwh'], 350)
+        self.assertEqual(out['lectura_anterior'], 1200)
+        self.assertIsNone(out['lectura_actual'])
+        self.assertEqual(out['total_recibo_mxn'], 812.46)
+        self.assertEqual(out['tarifa'], '1C')
+        self.assertEqual(out['multiplicador'], 1)
+        self.assertEqual(out['periodo_inicio'], '2024-12-01')
+        self.assertEqual(out['periodo_fin'], '2025-01-31')
+        self.assertIsNone(out['subtotal_basico_mxn'])
+        self.assertEqual(len(out), 15)
+
+
+class EncodeImageTests(TestCase):
+    """Tests for base64 encoding of receipt images."""
+
+    def test_encode_matches_b64encode(self):
+        extractor = CFEVisionExtractor.__new__(CFEVisionExtractor)
+        data = bytes(range(256)) * 40
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            self.assertEqual(
+                extractor._encode_image(f.name), base64.b64encode(data).decode()
+            )
+
+
+class BreakdownTests(TestCase):
+    """Tests for compute_breakdown_and_recs."""
+
+    def _survey(self, **kwargs):
+        campos = dict(
+            refrigeradores=1, ref_antiguedad='mid', ac_count=0, ac_horas_dia=0,
+            agua_caliente='gas', personas_en_casa=3, lavadora=True,
+            secadora=False, home_office=False, bombeo_agua=False,
+        )
+        campos.update(kwargs)
+        return SimpleNamespace(**campos)
+
+    def _bill(self, consumo_kwh):
+        return Bill(consumo_kwh=consumo_kwh, tarifa='1C')
+
+    def test_residual_goes_to_otros(self):
+        result = compute_breakdown_and_recs(self._bill(400), self._survey())
+        breakdown = result['breakdown']
+        self.assertEqual(sum(c['kwh'] for c in breakdown.values()), 400)
+        self.assertEqual(breakdown[CAT_OTROS]['kwh'], 240)
+        self.assertEqual(breakdown[CAT_OTROS]['pct'], 60.0)
+        self.assertAlmostEqual(sum(c['pct'] for c in breakdown.values()), 100.0, places=0)
+
+    def test_excess_trims_flexible_categories(self):
+        survey = self._survey(ac_count=2, ac_horas_dia=8, home_office=True)
+        result = compute_breakdown_and_recs(self._bill(300), survey)
+        breakdown = result['breakdown']
+        self.assertNotIn(CAT_OTROS, breakdown)
+        # Cada categoría flexible pierde como máximo 30%; standby absorbe el resto
+        self.assertEqual(breakdown[CAT_AC]['kwh'], 126)
+        self.assertEqual(breakdown[CAT_HO]['kwh'], 56)
+        self.assertEqual(breakdown[CAT_STANDBY]['kwh'], 10)
+        self.assertLessEqual(len(result['recomendaciones']), 3)
+
+    def test_small_excess_is_shared_proportionally(self):
+        result = compute_breakdown_and_recs(
+            self._bill(220), self._survey(home_office=True)
+        )
+        breakdown = result['breakdown']
+        self.assertEqual(breakdown[CAT_HO]['kwh'], 72)
+        self.assertEqual(breakdown[CAT_STANDBY]['kwh'], 27)
+
+
+class ComputeAllTests(TestCase):
+    """compute_all bundles the per-bill calculations."""
+
+    def test_matches_individual_functions(self):
+        bill = Bill(consumo_kwh=400, tarifa='1C')
+        self.assertEqual(
+            compute_all(bill),
+            {'costo': compute_cost_mxn(400, '1C'), 'co2e': compute_co2e_kg(400)},
+        )
+
+    def test_rec_totals(self):
+        recs = [
+            {'ahorro_anual_mxn': 100.555, 'reduccion_co2_kg_anual': 10},
+            {'ahorro_anual_mxn': None},
+        ]
+        self.assertEqual(compute_rec_totals(recs), (Decimal('100.56'), Decimal('10.0')))
+        self.assertEqual(compute_rec_totals(None), (Decimal('0.0'), Decimal('0.0')))
+
+
+class BulkIngestTests(CacheTestCase):
+    """Tests for bulk_ingest_bills."""
+
+    def test_ingest_creates_related_rows(self):
+        raw_list = [
+            dict(_BILL_DEFAULTS, consumo_kwh=100, respuestas={'tiene_ac': 'no'},
+                 recomendaciones=[{'ahorro_anual_mxn': 50, 'reduccion_co2_kg_anual': 2.5}]),
+            dict(_BILL_DEFAULTS, consumo_kwh=200, respuestas={'tiene_ac': 'ventana'}),
+            dict(_BILL_DEFAULTS, consumo_kwh=300),
+        ]
+        with CaptureQueriesContext(connection) as ctx:
+            bills = bulk_ingest_bills(raw_list)
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 3)
+        self.assertTrue(all(b.pk for b in bills))
+        self.assertEqual(Bill.objects.count(), 3)
+        self.assertEqual(Survey.objects.filter(tiene_ac='ventana').get().bill, bills[1])
+        analysis = AnalysisResult.objects.get()
+        self.assertEqual(analysis.bill, bills[0])
+        self.assertEqual(analysis.co2e_kg, Decimal('44.40'))
+        self.assertEqual(analysis.total_ahorro_anual_mxn, Decimal('50.00'))
+        self.assertEqual(analysis.total_co2_kg, Decimal('2.50'))
+
+
+class ExtractBillViewTests(CacheTestCase):
+    """Tests for the async OCR endpoint."""
+
+    def _upload(self, name='recibo.jpg'):
+        return SimpleUploadedFile(name, b'\xff\xd8\xff fake', content_type='image/jpeg')
+
+    def test_rejects_unsupported_extension(self):
+        response = self.client.post('/extract-bill/', {'evidencia_archivo': self._upload('r.gif')})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.json()['ok'])
+
+    def test_rejects_content_not_matching_extension(self):
+        for name, content in (('r.png', b'\xff\xd8\xff jpeg'), ('r.jpg', b'GIF89a...')):
+            upload = SimpleUploadedFile(name, content)
+            with mock.patch('energy.views_ocr._API_KEY', 'test'), \
+                    mock.patch.object(CFEVisionExtractor, 'extract_from_file_async') as extract:
+                response = self.client.post('/extract-bill/', {'evidencia_archivo': upload})
+            self.assertEqual(response.status_code, 400)
+            extract.assert_not_called()
+
+    def test_missing_api_key(self):
+        with mock.patch('energy.views_ocr._API_KEY', None):
+            response = self.client.post('/extract-bill/', {'evidencia_archivo': self._upload()})
+        self.assertEqual(response.status_code, 503)
+
+    def test_returns_extracted_fields(self):
+        with mock.patch('energy.views_ocr._API_KEY', 'test'), \
+                mock.patch.object(
+                    CFEVisionExtractor, 'extract_from_file_async',
+                    new=mock.AsyncMock(return_value={'consumo_kwh': 280}),
+                ):
+            response = self.client.post('/extract-bill/', {'evidencia_archivo': self._upload()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'ok': True, 'data': {'consumo_kwh': 280}})
+
+    def test_identical_upload_served_from_cache(self):
+        extract = mock.AsyncMock(return_value={'consumo_kwh': 280})
+        with mock.patch('energy.views_ocr._API_KEY', 'test'), \
+                mock.patch.object(CFEVisionExtractor, 'extract_from_file_async', new=extract):
+            for _ in range(2):
+                response = self.client.post('/extract-bill/', {'evidencia_archivo': self._upload()})
+                self.assertEqual(response.json()['data'], {'consumo_kwh': 280})
+        extract.assert_awaited_once()
+
+
+class PreprocessImageTests(TestCase):
+    """Tests for downscaling receipt images before OCR."""
+
+    def test_downscales_to_jpeg(self):
+        buf = io.BytesIO()
+        Image.new('RGBA', (4000, 3000), (255, 255, 255, 255)).save(buf, format='PNG')
+        out = _preprocess(io.BytesIO(buf.getvalue()))
+        with Image.open(io.BytesIO(out)) as img:
+            self.assertEqual(img.format, 'JPEG')
+            self.assertEqual(img.size, (1600, 1200))
+
+    def test_unreadable_image_keeps_original(self):
+        self.assertIsNone(_preprocess(io.BytesIO(b'not an image')))
+        extractor = CFEVisionExtractor.__new__(CFEVisionExtractor)
+        b64, mime = extractor._encode_bytes(b'not an image', 'image/png')
+        self.assertEqual(mime, 'image/png')
+
+    def test_encode_file_matches_bytes_in_chunks(self):
+        data = bytes(range(256)) * 5
+        extractor = ocr.CFEVisionExtractor.__new__(ocr.CFEVisionExtractor)
+        with mock.patch.object(ocr, '_B64_BLOQUE', 9):
+            b64, mime = extractor._encode_file(io.BytesIO(data), 'image/png')
+        self.assertEqual(b64, base64.b64encode(data).decode('ascii'))
+        self.assertEqual(mime, 'image/png')
+
+    def test_unreadable_path_keeps_detected_mime(self):
+        extractor = CFEVisionExtractor.__new__(CFEVisionExtractor)
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as f:
+            f.write(b'%PDF-1.4')
+            f.flush()
+            self.assertEqual(extractor._encode_path(f.name)[1], 'application/pdf')
+            self.assertEqual(extractor._encode_path(f.name, 'image/webp')[1], 'image/webp')
+
+    def test_async_preprocess_runs_off_the_event_loop(self):
+        extractor = ocr.CFEVisionExtractor.__new__(ocr.CFEVisionExtractor)
+        hilos = []
+
+        def preprocess(_fuente):
+            hilos.append(threading.current_thread())
+            return b'jpeg'
+
+        async def run():
+            with mock.patch.object(ocr, '_preprocess', side_effect=preprocess), \
+                    mock.patch.object(extractor, '_call_api_async', mock.AsyncMock(return_value={})):
+                await extractor.extract_from_file_async(io.BytesIO(b'x'), 'image/png')
+                await extractor.extract_from_bytes_async(b'x', 'image/png')
+
+        asyncio.run(run())
+        self.assertEqual(len(hilos), 2)
+        self.assertNotIn(threading.main_thread(), hilos)
+
+
+class ExtractorClientTests(TestCase):
+    """OpenAI clients are reused across extractor instances and requests."""
+
+    def test_client_reused(self):
+        a = CFEVisionExtractor(api_key='test')
+        b = CFEVisionExtractor(api_key='test')
+        self.assertIs(a.client, b.client)
+        self.assertIsNot(a.client, CFEVisionExtractor(api_key='other').client)
+
+    def test_view_extractor_singleton(self):
+        _get_extractor.cache_clear()
+        self.assertIs(_get_extractor('test'), _get_extractor('test'))
+
+    def test_async_client_per_event_loop(self):
+        extractor = CFEVisionExtractor(api_key='test')
+
+        async def dos_veces():
+            return extractor.async_client, extractor.async_client
+
+        a1, a2 = asyncio.run(dos_veces())
+        b1, _ = asyncio.run(dos_veces())
+        self.assertIs(a1, a2)
+        self.assertIsNot(a1, b1)
+
+
+class SafeConversionTests(TestCase):
+    """Tests for the OCR numeric converters."""
+
+    def test_safe_int(self):
+        self.assertEqual(_safe_int(280), 280)
+        self.assertEqual(_safe_int(280.9), 280)
+        self.assertEqual(_safe_int('280.0'), 280)
+        self.assertEqual(_safe_int(True), 1)
+        self.assertIsNone(_safe_int(float('inf')))
+        self.assertIsNone(_safe_int(float('nan')))
+        self.assertIsNone(_safe_int('n/a'))
+
+    def test_safe_float(self):
+        self.assertEqual(_safe_float(812.456), 812.46)
+        self.assertEqual(_safe_float(812), 812.0)
+        self.assertIsInstance(_safe_float(812), float)
+        self.assertEqual(_safe_float('12.5'), 12.5)
+        self.assertIsNone(_safe_float([]))
+
+
+class RecommendationsClientTests(TestCase):
+    """The recommendations OpenAI client is created once per process."""
+
+    def test_client_singleton(self):
+        with mock.patch.object(recommendations, '_client', None), \
+                mock.patch.dict('os.environ', {'OPENAI_API_KEY': 'test'}):
+            client = recommendations._get_client()
+            self.assertIs(recommendations._get_client(), client)
+
+    def test_missing_key(self):
+        with mock.patch.object(recommendations, '_client', None), \
+                mock.patch.dict('os.environ', {}, clear=True):
+            with self.assertRaises(RuntimeError):
+                recommendations._get_client()
+
+
+class BuildPromptTests(TestCase):
+    """The system prompt is shared verbatim; user data goes in the user turn."""
+
+    def test_static_system_prefix(self):
+        a = _build_prompt({'tiene_ac': 'no'}, '1C', 280)
+        b = _build_prompt({'tiene_ac': 'ventana'}, 'DAC', 900)
+        self.assertEqual([m['role'] for m in a], ['system', 'user'])
+        self.assertEqual(a[0], b[0])
+        self.assertIn('Consumo del periodo: 900 kWh', b[1]['content'])
+        self.assertIn('$3.120 MXN/kWh', b[1]['content'])
+
+    def test_precio_kwh(self):
+        self.assertEqual(_precio_kwh('DAC'), 3.12)
+        self.assertEqual(_precio_kwh('tarifa 1a'), 1.147)
+        self.assertEqual(_precio_kwh('XYZ'), 1.47)
+
+    def test_compact_answers_skip_negatives(self):
+        respuestas = {
+            'tiene_ac': 'no', 'tvs': '0', 'cambios_recientes': [],
+            'refrigeradores': '2', 'siempre_encendidos': ['router', 'camaras'],
+        }
+        user = _build_prompt(respuestas, '1C', 280)[1]['content']
+        self.assertIn('refrigeradores=2\nsiempre_encendidos=router,camaras', user)
+        self.assertNotIn('tiene_ac', user)
+        self.assertNotIn('tvs', user)
+        self.assertNotIn('cambios_recientes', user)
+
+
+class RecommendationsCacheTests(CacheTestCase):
+    """Identical prompts are served from the LLM response cache."""
+
+    def _fake_client(self, content):
+        def create(**kwargs):
+            if kwargs.get('stream'):
+                # Un chunk por carácter, como generador (tiene close())
+                return (
+                    SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=c))])
+                    for c in content
+                )
+            message = SimpleNamespace(content=content)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+        client = mock.Mock()
+        client.chat.completions.create.side_effect = create
+        return client
+
+    def test_second_call_hits_cache(self):
+        client = self._fake_client(
+            '[{"titulo": "LED", "tipo": "sin_inversion", "ahorro_mensual_mxn": 10}]'
+        )
+        with mock.patch.object(recommendations, '_get_client', return_value=client):
+            first = recommendations.get_recommendations({'tiene_ac': 'no'}, '1C', 280)
+            second = recommendations.get_recommendations({'tiene_ac': 'no'}, '1C', 280)
+            recommendations.get_recommendations({'tiene_ac': 'no'}, '1C', 300)
+        self.assertEqual(first, second)
+        self.assertEqual(first[0]['titulo'], 'LED')
+        self.assertEqual(client.chat.completions.create.call_count, 2)
+        response_format = client.chat.completions.create.call_args.kwargs['response_format']
+        self.assertEqual(response_format['type'], 'json_schema')
+        self.assertTrue(response_format['json_schema']['strict'])
+
+    def test_deterministic_request_called_once(self):
+        client = self._fake_client('{"recomendaciones": [{"titulo": "LED"}]}')
+        args = ({'tiene_ac': 'ventana', 'ac_unidades': '2'}, 'DAC', 900)
+        with mock.patch.object(recommendations, '_get_client', return_value=client):
+            recommendations.get_recommendations(*args)
+            recommendations.get_recommendations(*args)
+        client.chat.completions.create.assert_called_once()
+        self.assertEqual(client.chat.completions.create.call_args.kwargs['temperature'], 0)
+
+    def test_stream_stops_after_five(self):
+        recs = ', '.join('{"titulo": "R%d"}' % i for i in range(7))
+        client = self._fake_client('{"recomendaciones": [%s]}' % recs)
+        with mock.patch.object(recommendations, '_get_client', return_value=client):
+            out = recommendations.get_recommendations({}, '1C', 280)
+        self.assertEqual([r['titulo'] for r in out], ['R0', 'R1', 'R2', 'R3', 'R4'])
+        self.assertEqual([r['prioridad'] for r in out], [1, 2, 3, 4, 5])
+        self.assertTrue(client.chat.completions.create.call_args.kwargs['stream'])
+
+    def test_empty_result_not_cached(self):
+        client = self._fake_client('no es json')
+        with mock.patch.object(recommendations, '_get_client', return_value=client):
+            recommendations.get_recommendations({}, '1C', 280)
+            recommendations.get_recommendations({}, '1C', 280)
+        self.assertEqual(client.chat.completions.create.call_count, 2)
+
+    def test_batch_single_call_and_cache_fill(self):
+        client = self._fake_client(
+            '[[{"titulo": "A"}], [{"titulo": "B"}, {"titulo": "C"}]]'
+        )
+        jobs = [({'tiene_ac': 'no'}, '1C', 280), ({'tiene_ac': 'si'}, 'DAC', 800)]
+        with mock.patch.object(recommendations, '_get_client', return_value=client):
+            batch = recommendations.get_recommendations_batch(jobs)
+            single = recommendations.get_recommendations(*jobs[1])
+        self.assertEqual([[r['titulo'] for r in recs] for recs in batch], [['A'], ['B', 'C']])
+        self.assertEqual(single, batch[1])
+        self.assertEqual(client.chat.completions.create.call_count, 1)
+
+    def test_batch_falls_back_on_mismatch(self):
+        client = self._fake_client('[{"titulo": "A"}]')
+        jobs = [({}, '1C', 280), ({}, '1C', 300)]
+        with mock.patch.object(recommendations, '_get_client', return_value=client):
+            batch = recommendations.get_recommendations_batch(jobs)
+        self.assertEqual([len(recs) for recs in batch], [1, 1])
+        self.assertEqual(client.chat.completions.create.call_count, 3)
+
+    def test_recompute_command(self):
+        bill = _bill()
+        Survey.objects.create(bill=bill, respuestas={'tiene_ac': 'no'})
+        with mock.patch(
+            'energy.management.commands.recompute_recommendations.get_recommendations_batch',
+            return_value=[[{'titulo': 'LED'}]],
+        ):
+            call_command('recompute_recommendations', stdout=StringIO())
+        self.assertEqual(bill.analysis.recomendaciones_json, [{'titulo': 'LED'}])
+
+    def test_recompute_keeps_analysis_when_batch_returns_nothing(self):
+        bill = _bill()
+        Survey.objects.create(bill=bill, respuestas={'tiene_ac': 'no'})
+        AnalysisResult.objects.create(
+            bill=bill, costo_estimado_mxn=Decimal('1.00'), co2e_kg=Decimal('1.00'),
+            recomendaciones_json=[{'titulo': 'LED'}],
+        )
+        out = StringIO()
+        with mock.patch(
+            'energy.management.commands.recompute_recommendations.get_recommendations_batch',
+            return_value=[[]],
+        ):
+            call_command('recompute_recommendations', stdout=out, stderr=StringIO())
+        bill.analysis.refresh_from_db()
+        self.assertEqual(bill.analysis.recomendaciones_json, [{'titulo': 'LED'}])
+        self.assertIn('1 bills failed', out.getvalue())
+
+    def test_seed_demo_analyses_command(self):
+        pendiente = _bill(is_demo=True)
+        hecho = _bill(consumo_kwh=800, is_demo=True)
+        normal = _bill(consumo_kwh=300)
+        for bill in (pendiente, hecho, normal):
+            Survey.objects.create(bill=bill, respuestas={'tiene_ac': 'no'})
+        AnalysisResult.objects.create(
+            bill=hecho, costo_estimado_mxn=Decimal('1.00'), co2e_kg=Decimal('1.00'),
+        )
+        with mock.patch(
+            'energy.management.commands.seed_demo_analyses.get_recommendations_batch',
+            return_value=[[{'titulo': 'LED', 'ahorro_anual_mxn': 120}]],
+        ) as batch, CaptureQueriesContext(connection) as ctx:
+            call_command('seed_demo_analyses', stdout=StringIO())
+        self.assertEqual(len(batch.call_args.args[0]), 1)
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 1)
+        analysis = AnalysisResult.objects.get(bill=pendiente)
+        self.assertEqual(analysis.total_ahorro_anual_mxn, Decimal('120.00'))
+        self.assertFalse(AnalysisResult.objects.filter(bill=normal).exists())
+
+    def test_seed_demo_analyses_batches_and_skips_empty(self):
+        bills = [_bill(consumo_kwh=280 + i, is_demo=True) for i in range(3)]
+        for bill in bills:
+            Survey.objects.create(bill=bill, respuestas={'tiene_ac': 'no'})
+        lotes = [[[{'titulo': 'LED'}], []], [[{'titulo': 'AC'}]]]
+        with mock.patch(
+            'energy.management.commands.seed_demo_analyses.get_recommendations_batch',
+            side_effect=lotes,
+        ) as batch:
+            call_command('seed_demo_analyses', '--batch-size=2', stdout=StringIO())
+        self.assertEqual([len(c.args[0]) for c in batch.call_args_list], [2, 1])
+        con_analisis = set(AnalysisResult.objects.values_list('bill_id', flat=True))
+        # El vacío queda pendiente para el siguiente seed
+        self.assertEqual(con_analisis, {bills[0].id, bills[2].id})
+
+
+class AsyncRecommendationsTests(CacheTestCase):
+    """The async recommendations path used by the results view."""
+
+    def test_results_view_renders_placeholder_without_calling_openai(self):
+        bill = _bill()
+        Survey.objects.create(bill=bill, respuestas={'tiene_ac': 'no'})
+        with mock.patch('energy.views.stream_recommendations_async') as stream:
+            response = self.client.get(f'/results/{bill.id}/')
+        stream.assert_not_called()
+        self.assertTemplateUsed(response, 'energy/results_pending.html')
+        self.assertContains(response, f'/results/{bill.id}/stream/')
+        self.assertFalse(AnalysisResult.objects.filter(bill=bill).exists())
+
+    def test_many_runs_in_parallel_and_keeps_order(self):
+        en_vuelo = {'actual': 0, 'max': 0}
+
+        async def fake(respuestas, tarifa, consumo_kwh):
+            en_vuelo['actual'] += 1
+            en_vuelo['max'] = max(en_vuelo['max'], en_vuelo['actual'])
+            await asyncio.sleep(0.01)
+            en_vuelo['actual'] -= 1
+            return [consumo_kwh]
+
+        jobs = [({}, '1C', kwh) for kwh in range(15)]
+        with mock.patch.object(recommendations_async, 'get_recommendations_async', new=fake):
+            out = asyncio.run(recommendations_async.get_recommendations_many_async(jobs))
+        self.assertEqual(out, [[kwh] for kwh in range(15)])
+        self.assertEqual(en_vuelo['max'], 10)
+
+
+class StreamingRecommendationsTests(CacheTestCase):
+    """Incremental parsing and the SSE results endpoint."""
+
+    def test_parser_yields_objects_as_they_close(self):
+        parser = _ArrayObjectParser()
+        self.assertEqual(parser.feed('```json\n[{"titulo": "A {x}'), [])
+        self.assertEqual(parser.feed('", "n": [1]}, {"titulo"'), [{'titulo': 'A {x}', 'n': [1]}])
+        self.assertEqual(parser.feed(': "B \\" }"}]\n```'), [{'titulo': 'B " }'}])
+
+    def test_parser_handles_wrapped_array(self):
+        parser = _ArrayObjectParser()
+        out = parser.feed('{"recomendaciones": [{"titulo": "A", "x": {"y": 1}}, {"titulo": "B"}]}')
+        self.assertEqual([o['titulo'] for o in out], ['A', 'B'])
+
+    def _chunks(self, *parts):
+        async def gen():
+            for part in parts:
+                delta = SimpleNamespace(content=part)
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+        return gen()
+
+    async def test_stream_endpoint_emits_and_stores(self):
+        bill = await _abill()
+        await Survey.objects.acreate(bill=bill, respuestas={'tiene_ac': 'no'})
+        client = mock.Mock()
+        client.chat.completions.create = mock.AsyncMock(
+            return_value=self._chunks('[{"titulo": "A"}', ', {"titulo": "B"}, {"titulo": "C"}',
+                                      ', {"titulo": "D"}, {"titulo": "E"}]')
+        )
+        with mock.patch.object(recommendations_async, '_get_client', return_value=client):
+            response = await self.async_client.get(f'/results/{bill.id}/stream/')
+            body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(body.count('data: {"titulo"'), 5)
+        self.assertTrue(body.endswith('event: done\ndata: {}\n\n'))
+        analysis = await AnalysisResult.objects.aget(bill=bill)
+        self.assertEqual([r['titulo'] for r in analysis.recomendaciones_json], list('ABCDE'))
+
+    async def _stream_body(self, bill):
+        response = await self.async_client.get(f'/results/{bill.id}/stream/')
+        return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+    async def _bill_with_survey(self):
+        bill = await _abill()
+        await Survey.objects.acreate(bill=bill, respuestas={'tiene_ac': 'no'})
+        return bill
+
+    async def test_stream_failure_sends_error_and_stores_nothing(self):
+        bill = await self._bill_with_survey()
+
+        async def corta():
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content='[{"titulo": "A"}'))])
+            raise RuntimeError('conexión cerrada')
+
+        client = mock.Mock()
+        client.chat.completions.create = mock.AsyncMock(return_value=corta())
+        with mock.patch.object(recommendations_async, '_get_client', return_value=client), \
+                self.assertLogs('energy.views', 'ERROR'):
+            body = await self._stream_body(bill)
+        self.assertTrue(body.endswith('event: error\ndata: {}\n\n'))
+        self.assertFalse(await AnalysisResult.objects.filter(bill=bill).aexists())
+        self.assertFalse(await cache.ahas_key(_generacion_lock_key(bill.id)))
+
+    async def test_stream_waits_for_generation_in_progress(self):
+        bill = await self._bill_with_survey()
+        await cache.aset(_generacion_lock_key(bill.id), True)
+
+        async def otra_peticion_termina(_segundos):
+            await AnalysisResult.objects.acreate(
+                bill=bill, costo_estimado_mxn=Decimal('1'), co2e_kg=Decimal('1'), recomendaciones_json=[],
+            )
+
+        client = mock.Mock()
+        with mock.patch.object(recommendations_async, '_get_client', return_value=client), \
+                mock.patch('energy.views.asyncio.sleep', side_effect=otra_peticion_termina):
+            body = await self._stream_body(bill)
+        self.assertEqual(body, 'event: done\ndata: {}\n\n')
+        client.chat.completions.create.assert_not_called()
+
+    async def test_sync_fallback_generates_and_redirects(self):
+        bill = await self._bill_with_survey()
+        recs = [{'titulo': str(i), 'tipo': 'sin_inversion'} for i in range(NUM_RECS)]
+        with mock.patch('energy.views.get_recommendations_async', mock.AsyncMock(return_value=recs)):
+            response = await self.async_client.get(f'/results/{bill.id}/?sync=1')
+        self.assertRedirects(response, f'/results/{bill.id}/', fetch_redirect_response=False)
+        analysis = await AnalysisResult.objects.aget(bill=bill)
+        self.assertEqual(len(analysis.recomendaciones_json), NUM_RECS)
+
+    async def test_sync_fallback_incomplete_shows_retry(self):
+        bill = await self._bill_with_survey()
+        with mock.patch('energy.views.get_recommendations_async', mock.AsyncMock(return_value=[])):
+            response = await self.async_client.get(f'/results/{bill.id}/?sync=1')
+        self.assertContains(response, 'Reintentar')
+        self.assertNotContains(response, 'EventSource')
+        self.assertFalse(await AnalysisResult.objects.filter(bill=bill).aexists())
+
+
+class ParseResponseTests(TestCase):
+    """Tests for extracting the recommendation list from a JSON-mode reply."""
+
+    def test_variants(self):
+        self.assertEqual(_parse_response('{"recomendaciones": [1, 2]}', 'recomendaciones'), [1, 2])
+        self.assertEqual(_parse_response('[1, 2]', 'recomendaciones'), [1, 2])
+        self.assertIsNone(_parse_response('{"otra": [1]}', 'recomendaciones'))
+        # Respuesta cortada por max_tokens
+        self.assertIsNone(_parse_response('{"recomendaciones": [1', 'recomendaciones'))
+
+
+class SurveyFormCacheTests(CacheTestCase):
+    """The choice-driven part of the survey form is a cached fragment."""
+
+    def test_choices_fragment_is_cached(self):
+        bill = _bill()
+        key = make_template_fragment_key('survey_choices_v1')
+        self.assertIsNone(cache.get(key))
+        response = self.client.get(f'/survey/{bill.id}/')
+        self.assertContains(response, 'Sí, minisplit inverter')
+        self.assertIn('Sí, minisplit inverter', cache.get(key))
+        # El form (csrf, hx-post) queda fuera del fragmento
+        self.assertNotIn('csrfmiddlewaretoken', cache.get(key))
+        self.assertContains(self.client.get(f'/survey/{bill.id}/'), 'Sí, minisplit inverter')
+
+
+class ParseSurveyPostTests(TestCase):
+    """Tests for the table-driven survey POST parser."""
+
+    def _parse(self, data):
+        q = QueryDict(mutable=True)
+        for key, value in data.items():
+            q.setlist(key, value if isinstance(value, list) else [value])
+        return _parse_survey_post(q)
+
+    def test_empty_post_uses_defaults(self):
+        r = self._parse({})
+        self.assertEqual(r['tiene_ac'], 'no')
+        self.assertEqual(r['refrigeradores'], '1')
+        self.assertEqual(r['ref_antiguedad'], 'no_se')
+        self.assertEqual(r['cambios_recientes'], [])
+        self.assertNotIn('ac_unidades', r)
+        self.assertNotIn('culpables_uso', r)
+
+    def test_dependent_fields_follow_parent_answer(self):
+        r = self._parse({
+            'tiene_ac': 'ventana', 'ac_unidades': '2',
+            'agua_caliente_tipo': 'mixto', 'agua_caliente_equipo': ['boiler_electrico', 'ambos'],
+            'refrigeradores': '0', 'ref_antiguedad': 'viejo',
+            'culpables_ocultos': ['acuario'], 'culpables_uso': '3-5',
+        })
+        self.assertEqual(r['ac_unidades'], '2')
+        self.assertEqual(r['ac_horas_dia'], '')
+        self.assertEqual(r['agua_caliente_equipo'], ['boiler_electrico', 'ambos'])
+        self.assertNotIn('ref_antiguedad', r)
+        self.assertEqual(r['culpables_uso'], '3-5')
+
+    def test_every_dependency_points_to_an_earlier_field(self):
+        vistos = set()
+        for key, _default, _multi, dep in _SURVEY_FIELDS:
+            if dep is not None:
+                self.assertIn(dep[0], vistos, key)
+            vistos.add(key)
+
+
+class HomeAndHistoryQueryTests(CacheTestCase):
+    """The landing and history pages run a single narrow query."""
+
+    def test_cache_backend_shared_across_processes(self):
+        # seed_demo/recompute corren en otro proceso: LocMem no vería sus
+        # invalidaciones.  Se lee el módulo porque los tests usan su propia cache.
+        self.assertNotIn('locmem', project_settings.CACHES['default']['BACKEND'])
+        self.assertIn('locmem', settings.CACHES['default']['BACKEND'])
+
+    def test_home_single_query(self):
+        _bill(is_demo=True)
+        with self.assertNumQueries(1):
+            response = self.client.get('/')
+        self.assertContains(response, '280 kWh')
+
+    def test_home_demos_cached_until_demo_changes(self):
+        bill = _bill(is_demo=True)
+        self.client.get('/')
+        with self.assertNumQueries(0):
+            self.client.get('/')
+        # Un recibo normal no invalida
+        _bill(consumo_kwh=500)
+        with self.assertNumQueries(0):
+            self.client.get('/')
+        bill.consumo_kwh = 310
+        bill.save()
+        self.assertContains(self.client.get('/'), '310 kWh')
+        bill.delete()
+        self.assertNotContains(self.client.get('/'), '310 kWh')
+
+    def test_history_loads_only_listed_columns(self):
+        bills = [
+            _bill(consumo_kwh=280 + i)
+            for i in range(5)
+        ]
+        session = self.client.session
+        session['bill_history'] = [b.id for b in bills]
+        session.save()
+        # Sesión en cookie firmada: la clave cambia al guardar
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/history/')
+        self.assertContains(response, '284')
+        # Sin N+1: la plantilla no toca survey/analysis
+        bill_queries = [q['sql'] for q in ctx.captured_queries if 'energy_bill' in q['sql']]
+        self.assertEqual(len(bill_queries), 1)
+        self.assertNotIn('evidencia_archivo', bill_queries[0])
+
+    def test_history_partial_cached_until_bill_changes(self):
+        bill = _bill()
+        session = self.client.session
+        session['bill_history'] = [bill.id]
+        session.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+        self.client.get('/history/', HTTP_HX_REQUEST='true')
+        # Un hit es una sola lectura de cache (get_many) y ninguna consulta
+        with self.assertNumQueries(0), \
+                mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many:
+            response = self.client.get('/history/', HTTP_HX_REQUEST='true')
+        self.assertContains(response, '280 kWh')
+        get_many.assert_called_once()
+
+        bill.consumo_kwh = 310
+        bill.save()
+        response = self.client.get('/history/', HTTP_HX_REQUEST='true')
+        self.assertContains(response, '310 kWh')
+
+
+class TemplateLoaderTests(TestCase):
+    """Partials are parsed once per process by the cached loader."""
+
+    def test_partial_compiled_once(self):
+        engine = engines['django'].engine
+        loader = engine.template_loaders[0]
+        self.assertEqual(type(loader).__module__, 'django.template.loaders.cached')
+        loader.reset()
+        with mock.patch.object(Template, 'compile_nodelist', autospec=True,
+                               side_effect=Template.compile_nodelist) as compile_nodelist:
+            engine.get_template('energy/partials/history_list.html')
+            engine.get_template('energy/partials/history_list.html')
+        self.assertEqual(compile_nodelist.call_count, 1)
@@ -17,6 +17,7 @@ urlpatterns = [
     path('bill/', views.create_bill, name='create_bill'),
     path('survey/<int:bill_id>/', views.survey, name='survey'),
     path('results/<int:bill_id>/', views.results, name='results'),
+    path('results/<int:bill_id>/stream/', views.results_stream, name='results_stream'),
     path('dashboard/<int:bill_id>/', views.dashboard, name='dashboard'),
 
     # OCR
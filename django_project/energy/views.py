@@ -2,14 +2,56 @@
 Views for the Electric Assistant MVP.
 """
 
-from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse
+import asyncio
+import json
+import logging
+from decimal import Decimal
+
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
 
 from .models import Bill, Survey, AnalysisResult
 from .forms import BillForm
-from .services.calculations import compute_cost_mxn, compute_co2e_kg
-from .services.recommendations import get_recommendations
+from .signals import (
+    DEMO_BILLS_CACHE_KEY,
+    HISTORY_CACHE_TTL,
+    HISTORY_GEN_KEY,
+    RESULTS_CACHE_TTL,
+    history_cache_key,
+    results_cache_key,
+)
+from .services.calculations import compute_all
+from .services.recommendations import NUM_RECS
+from .services.recommendations_async import (
+    get_recommendations_async,
+    stream_recommendations_async,
+)
+
+logger = logging.getLogger(__name__)
+
+# Una sola llamada a OpenAI por recibo: reconexiones de EventSource, otras
+# pestañas o el fallback síncrono esperan a la que ya está en curso.
+_GENERACION_TTL = 120  # s; cota de una generación (timeout de OpenAI + margen)
+_ESPERA_INTERVALO = 1
+
+
+def _generacion_lock_key(bill_id):
+    return f'energy:generando:{bill_id}'
+
+
+async def _guardar_analisis(bill, recs):
+    """Persiste el análisis; si otra petición ya lo creó, gana el existente."""
+    calc = compute_all(bill)
+    await AnalysisResult.objects.aget_or_create(
+        bill=bill,
+        defaults={
+            'costo_estimado_mxn': Decimal(str(calc['costo'])),
+            'co2e_kg': Decimal(str(calc['co2e'])),
+            'recomendaciones_json': recs,
+        },
+    )
 
 
 # ─── Choice tuples used by the new survey template ──────────────────────────
@@ -109,84 +151,99 @@ SURVEY_CHOICES = {
 }
 
 
-def _parse_survey_post(post) -> dict:
-    """
-    Parsea el POST de la nueva encuesta condicional y retorna
-    el dict `respuestas` listo para guardar en Survey.respuestas.
-    """
-    r = {}
-
-    # 1. Cambios recientes (checkbox multiple)
-    r['cambios_recientes'] = post.getlist('cambios_recientes')
+# (clave, default, multi, depende_de): depende_de es (clave_previa, condición)
+# y la pregunta solo se guarda si la condición se cumple para el valor ya
+# parseado de clave_previa.  El orden importa.
+_SURVEY_FIELDS = (
+    # 1. Cambios recientes
+    ('cambios_recientes', None, True, None),
 
     # 2. A/C
-    r['tiene_ac'] = post.get('tiene_ac', 'no')
-    if r['tiene_ac'] != 'no':
-        r['ac_unidades'] = post.get('ac_unidades', '')
-        r['ac_dias_semana'] = post.get('ac_dias_semana', '')
-        r['ac_horas_dia'] = post.get('ac_horas_dia', '')
-        r['ac_temperatura'] = post.get('ac_temperatura', '')
+    ('tiene_ac', 'no', False, None),
+    ('ac_unidades', '', False, ('tiene_ac', lambda v: v != 'no')),
+    ('ac_dias_semana', '', False, ('tiene_ac', lambda v: v != 'no')),
+    ('ac_horas_dia', '', False, ('tiene_ac', lambda v: v != 'no')),
+    ('ac_temperatura', '', False, ('tiene_ac', lambda v: v != 'no')),
 
     # 3. Agua caliente
-    r['agua_caliente_tipo'] = post.get('agua_caliente_tipo', 'gas')
-    if r['agua_caliente_tipo'] in ('electrico', 'mixto'):
-        r['agua_caliente_equipo'] = post.getlist('agua_caliente_equipo')
-        r['agua_personas'] = post.get('agua_personas', '')
-        r['agua_duracion'] = post.get('agua_duracion', '')
+    ('agua_caliente_tipo', 'gas', False, None),
+    ('agua_caliente_equipo', None, True, ('agua_caliente_tipo', lambda v: v in ('electrico', 'mixto'))),
+    ('agua_personas', '', False, ('agua_caliente_tipo', lambda v: v in ('electrico', 'mixto'))),
+    ('agua_duracion', '', False, ('agua_caliente_tipo', lambda v: v in ('electrico', 'mixto'))),
 
     # 4. Refrigeración
-    r['refrigeradores'] = post.get('refrigeradores', '1')
-    if r['refrigeradores'] != '0':
-        r['ref_antiguedad'] = post.get('ref_antiguedad', 'no_se')
+    ('refrigeradores', '1', False, None),
+    ('ref_antiguedad', 'no_se', False, ('refrigeradores', lambda v: v != '0')),
 
     # 5. Secadora
-    r['tiene_secadora'] = post.get('tiene_secadora', 'no')
-    if r['tiene_secadora'] == 'electrica':
-        r['secadora_cargas'] = post.get('secadora_cargas', '')
-        r['secadora_alto_calor'] = post.get('secadora_alto_calor', '')
+    ('tiene_secadora', 'no', False, None),
+    ('secadora_cargas', '', False, ('tiene_secadora', lambda v: v == 'electrica')),
+    ('secadora_alto_calor', '', False, ('tiene_secadora', lambda v: v == 'electrica')),
 
     # 6. Bombas
-    r['tiene_bomba'] = post.get('tiene_bomba', 'no')
-    if r['tiene_bomba'] == 'si':
-        r['bomba_frecuencia'] = post.get('bomba_frecuencia', '')
-    r['tiene_bomba_alberca'] = post.get('tiene_bomba_alberca', 'no')
-    if r['tiene_bomba_alberca'] == 'si':
-        r['bomba_alberca_horas'] = post.get('bomba_alberca_horas', '')
+    ('tiene_bomba', 'no', False, None),
+    ('bomba_frecuencia', '', False, ('tiene_bomba', lambda v: v == 'si')),
+    ('tiene_bomba_alberca', 'no', False, None),
+    ('bomba_alberca_horas', '', False, ('tiene_bomba_alberca', lambda v: v == 'si')),
 
     # 7. Calefactor
-    r['calefactor'] = post.get('calefactor', 'no')
-    if r['calefactor'] in ('ocasional', 'frecuente'):
-        r['calefactor_horas'] = post.get('calefactor_horas', '')
+    ('calefactor', 'no', False, None),
+    ('calefactor_horas', '', False, ('calefactor', lambda v: v in ('ocasional', 'frecuente'))),
 
     # 8. Cocina
-    r['cocina_tipo'] = post.get('cocina_tipo', 'gas')
-    r['cocina_horno'] = post.get('cocina_horno', 'no')
-    r['cocina_airfryer'] = post.get('cocina_airfryer', 'no')
-    r['cocina_parrilla'] = post.get('cocina_parrilla', 'no')
-    r['cocina_hervidor'] = post.get('cocina_hervidor', 'no')
+    ('cocina_tipo', 'gas', False, None),
+    ('cocina_horno', 'no', False, None),
+    ('cocina_airfryer', 'no', False, None),
+    ('cocina_parrilla', 'no', False, None),
+    ('cocina_hervidor', 'no', False, None),
 
     # 9. Siempre encendidos
-    r['tvs'] = post.get('tvs', '0')
-    r['pc_uso'] = post.get('pc_uso', 'no')
-    r['consola'] = post.get('consola', 'no')
-    r['siempre_encendidos'] = post.getlist('siempre_encendidos')
+    ('tvs', '0', False, None),
+    ('pc_uso', 'no', False, None),
+    ('consola', 'no', False, None),
+    ('siempre_encendidos', None, True, None),
 
     # 10. Culpables ocultos
-    r['culpables_ocultos'] = post.getlist('culpables_ocultos')
-    if r['culpables_ocultos']:
-        r['culpables_uso'] = post.get('culpables_uso', '')
+    ('culpables_ocultos', None, True, None),
+    ('culpables_uso', '', False, ('culpables_ocultos', bool)),
+)
 
+
+def _parse_survey_post(post) -> dict:
+    """
+    Parsea el POST de la nueva encuesta condicional y retorna
+    el dict `respuestas` listo para guardar en Survey.respuestas.
+    """
+    r = {}
+    for key, default, multi, dep in _SURVEY_FIELDS:
+        if dep is not None and not dep[1](r.get(dep[0])):
+            continue
+        r[key] = post.getlist(key) if multi else post.get(key, default)
     return r
 
 
+_DASHBOARD_FIELDS = (
+    'id', 'tarifa', 'periodo_fin', 'consumo_kwh', 'total_recibo_mxn', 'subsidio_mxn',
+    'periodo_basico_kwh', 'periodo_intermedio_kwh', 'periodo_excedente_kwh',
+    'subtotal_basico_mxn', 'subtotal_intermedio_mxn', 'subtotal_excedente_mxn',
+)
+
+
 # ─── VIEWS ───────────────────────────────────────────────────────────────────
 
 def home(request):
     """Página principal."""
-    demo_bills = Bill.objects.filter(is_demo=True).order_by('id')[:2]
+    # Cacheada; las señales de Bill la invalidan cuando cambia un demo
+    demo_bills = cache.get_or_set(
+        DEMO_BILLS_CACHE_KEY,
+        lambda: list(
+            Bill.objects.filter(is_demo=True).only('id', 'tarifa', 'consumo_kwh').order_by('id')[:2]
+        ),
+        60 * 60,
+    )
     return render(request, 'energy/home.html', {
         'demo_bills': demo_bills,
-        'has_demos': demo_bills.exists(),
+        'has_demos': bool(demo_bills),
     })
 
 
@@ -207,11 +264,12 @@ def create_bill(request):
     if form.is_valid():
         bill = form.save()
 
-        # Guardar en historial de sesión
-        if 'bill_history' not in request.session:
-            request.session['bill_history'] = []
-        request.session['bill_history'] = [bill.id] + request.session['bill_history'][:4]
-        request.session.modified = True
+        # Guardar en historial de sesión (sin duplicados, máximo 5); la
+        # asignación ya marca la sesión como modificada
+        anterior = request.session.get('bill_history', [])
+        historial = [bill.id] + [x for x in anterior if x != bill.id][:4]
+        if historial != anterior:
+            request.session['bill_history'] = historial
 
         # Redirigir al dashboard
         if request.htmx:
@@ -252,50 +310,43 @@ def survey(request, bill_id):
     return render(request, 'energy/wizard.html', context)
 
 
-def results(request, bill_id):
-    """Obtiene recomendaciones de OpenAI y las muestra."""
-    bill = get_object_or_404(Bill, id=bill_id)
+async def results(request, bill_id):
+    """
+    Muestra las recomendaciones guardadas.  Si aún no existen, responde de
+    inmediato con una página "generando" que se suscribe a `results_stream`
+    (donde ocurre la llamada a OpenAI) y recarga al terminar.
+    """
+    key = results_cache_key(bill_id)
+    context = await cache.aget(key)
+    if context is not None:
+        return render(request, 'energy/results.html', context)
+
+    bill = await aget_object_or_404(Bill.objects.with_details(), id=bill_id)
 
     # Verificar que exista el survey
     try:
-        survey_obj = bill.survey
+        bill.survey
     except Survey.DoesNotExist:
         return redirect('energy:survey', bill_id=bill.id)
 
-    respuestas = survey_obj.respuestas
-
-    # ── Obtener o generar recomendaciones ──
-    # Guardamos en AnalysisResult.recomendaciones_json para no llamar a OpenAI
-    # cada vez que el usuario refresca la página.
     try:
         analysis = bill.analysis
-        recs = analysis.recomendaciones_json
     except AnalysisResult.DoesNotExist:
-        # Llamar a OpenAI
-        try:
-            recs = get_recommendations(respuestas, bill.tarifa, bill.consumo_kwh)
-        except Exception as exc:
-            # Fallback: mostrar error amable
-            recs = []
-            # Podrías logear exc aquí
-
-        # Guardar para evitar llamadas repetidas
-        costo = compute_cost_mxn(bill.consumo_kwh, bill.tarifa)
-        co2e = compute_co2e_kg(bill.consumo_kwh)
-        AnalysisResult.objects.create(
-            bill=bill,
-            costo_estimado_mxn=costo,
-            co2e_kg=co2e,
-            recomendaciones_json=recs,
-        )
-
-    # ── Separar por tipo ──
-    recs_sin = [r for r in recs if r.get('tipo') == 'sin_inversion']
-    recs_con = [r for r in recs if r.get('tipo') == 'con_inversion']
-
-    # ── Totales para el summary strip ──
-    total_ahorro_anual = sum(r.get('ahorro_anual_mxn', 0) for r in recs)
-    total_co2 = sum(r.get('reduccion_co2_kg_anual', 0) for r in recs)
+        if request.GET.get('sync'):
+            return await _results_sync(request, bill)
+        return render(request, 'energy/results_pending.html', {'bill': bill})
+
+    # ── Separar por tipo (una pasada); los totales vienen precalculados ──
+    recs_sin = []
+    recs_con = []
+    for r in analysis.recomendaciones_json:
+        tipo = r.get('tipo')
+        if tipo == 'sin_inversion':
+            recs_sin.append(r)
+        elif tipo == 'con_inversion':
+            recs_con.append(r)
+    total_ahorro_anual = analysis.total_ahorro_anual_mxn
+    total_co2 = analysis.total_co2_kg
 
     context = {
         'bill': bill,
@@ -304,38 +355,124 @@ def results(request, bill_id):
         'total_ahorro_anual': total_ahorro_anual,
         'total_co2': total_co2,
     }
+    # Las señales de Bill/Survey/AnalysisResult borran la entrada
+    await cache.aset(key, context, RESULTS_CACHE_TTL)
     return render(request, 'energy/results.html', context)
 
 
+async def _results_sync(request, bill):
+    """
+    Fallback sin EventSource (sin JS, o si el stream falló o el servidor
+    bufferea la respuesta): genera en la misma petición y redirige.
+    """
+    lock = _generacion_lock_key(bill.id)
+    if not await cache.aadd(lock, True, _GENERACION_TTL):
+        # Ya hay una generación en curso; la página pendiente la espera
+        return render(request, 'energy/results_pending.html', {'bill': bill})
+
+    try:
+        recs = await get_recommendations_async(
+            bill.survey.respuestas, bill.tarifa, bill.consumo_kwh
+        )
+    except Exception:
+        logger.exception('Falló la generación de recomendaciones del recibo %s', bill.id)
+        recs = []
+    try:
+        if len(recs) >= NUM_RECS:
+            await _guardar_analisis(bill, recs)
+    finally:
+        await cache.adelete(lock)
+
+    if len(recs) < NUM_RECS:
+        return render(request, 'energy/results_pending.html', {'bill': bill, 'error': True})
+    return redirect('energy:results', bill_id=bill.id)
+
+
+async def results_stream(request, bill_id):
+    """
+    Server-Sent Events con las recomendaciones: un evento por recomendación
+    en cuanto el modelo la termina, y `done` al final.  Si ya estaban
+    guardadas se envían de inmediato.  Si la generación falla o llega
+    incompleta se envía `error` y no se guarda nada.
+
+    Requiere un servidor ASGI: bajo WSGI Django consume todo el iterador
+    async antes de responder y los eventos llegan juntos al final.
+    """
+    bill = await aget_object_or_404(Bill.objects.with_details(), id=bill_id)
+    try:
+        survey_obj = bill.survey
+    except Survey.DoesNotExist:
+        return HttpResponse(status=409)
+
+    async def esperar_otra_generacion(lock):
+        # Hasta que la otra petición guarde el análisis o suelte el lock
+        for _ in range(_GENERACION_TTL // _ESPERA_INTERVALO):
+            await asyncio.sleep(_ESPERA_INTERVALO)
+            if await AnalysisResult.objects.filter(bill_id=bill.id).aexists():
+                return True
+            if not await cache.ahas_key(lock):
+                break
+        return await AnalysisResult.objects.filter(bill_id=bill.id).aexists()
+
+    async def eventos():
+        try:
+            recs = bill.analysis.recomendaciones_json
+        except AnalysisResult.DoesNotExist:
+            recs = None
+
+        if recs is not None:
+            for rec in recs:
+                yield f"data: {json.dumps(rec)}\n\n"
+            yield "event: done\ndata: {}\n\n"
+            return
+
+        lock = _generacion_lock_key(bill.id)
+        if not await cache.aadd(lock, True, _GENERACION_TTL):
+            if await esperar_otra_generacion(lock):
+                yield "event: done\ndata: {}\n\n"
+            else:
+                yield "event: error\ndata: {}\n\n"
+            return
+
+        recs = []
+        try:
+            try:
+                async for rec in stream_recommendations_async(
+                    survey_obj.respuestas, bill.tarifa, bill.consumo_kwh
+                ):
+                    recs.append(rec)
+                    yield f"data: {json.dumps(rec)}\n\n"
+            except Exception:
+                logger.exception('Falló la generación de recomendaciones del recibo %s', bill.id)
+            # Incompleto: no se guarda, así results() lo vuelve a intentar
+            if len(recs) >= NUM_RECS:
+                await _guardar_analisis(bill, recs)
+        finally:
+            await cache.adelete(lock)
+
+        if len(recs) < NUM_RECS:
+            yield "event: error\ndata: {}\n\n"
+        else:
+            yield "event: done\ndata: {}\n\n"
+
+    response = StreamingHttpResponse(eventos(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
 def dashboard(request, bill_id):
     """Dashboard del recibo (sin cambios)."""
-    bill = get_object_or_404(Bill, id=bill_id)
+    # Solo las columnas que usa la plantilla (directas o vía propiedades)
+    bill = get_object_or_404(Bill.objects.only(*_DASHBOARD_FIELDS), id=bill_id)
 
-    total_consumo = bill.consumo_kwh
-    if bill.consumo_excedente > 0:
-        basico_pct = 100.0
-        intermedio_pct = 100.0
-        excedente_pct = (bill.consumo_excedente / total_consumo * 100) if total_consumo > 0 else 0
-    elif bill.consumo_intermedio > 0:
-        basico_pct = 100.0
-        intermedio_pct = (bill.consumo_intermedio / 130 * 100) if bill.consumo_intermedio > 0 else 0
-        excedente_pct = 0
-    else:
-        basico_pct = (bill.consumo_basico / 150 * 100) if bill.consumo_basico > 0 else 0
-        intermedio_pct = 0
-        excedente_pct = 0
-
-    return render(request, 'energy/dashboard.html', {
-        'bill': bill,
-        'basico_pct': basico_pct,
-        'intermedio_pct': intermedio_pct,
-        'excedente_pct': excedente_pct,
-    })
+    return render(request, 'energy/dashboard.html', {'bill': bill})
 
 
 def load_demo(request, demo_id):
     """Carga un recibo demo y muestra resultados."""
-    demo_bill = get_object_or_404(Bill, id=demo_id, is_demo=True)
+    demo_bill = get_object_or_404(
+        Bill.objects.select_related('survey').only('id', 'survey__id'), id=demo_id, is_demo=True
+    )
     try:
         _ = demo_bill.survey
     except Survey.DoesNotExist:
@@ -346,9 +483,27 @@ def load_demo(request, demo_id):
 def history(request):
     """Historial de análisis recientes."""
     bill_ids = request.session.get('bill_history', [])
-    bills = Bill.objects.filter(id__in=bill_ids, is_demo=False).order_by('-created_at')[:5]
+    key = history_cache_key(bill_ids)
+
+    # El polling de HTMX repite la misma lista: servir el HTML ya renderizado
+    if request.htmx:
+        hits = cache.get_many([HISTORY_GEN_KEY, key])
+        gen = hits.get(HISTORY_GEN_KEY, 0)
+        guardado = hits.get(key)
+        if guardado is not None and guardado[0] == gen:
+            return HttpResponse(guardado[1])
+
+    bills = (
+        Bill.objects.filter(id__in=bill_ids, is_demo=False)
+        .only('id', 'tarifa', 'consumo_kwh', 'periodo_inicio', 'periodo_fin')
+        .order_by('-created_at')[:5]
+    )
 
     context = {'bills': bills}
     if request.htmx:
-        return render(request, 'energy/partials/history_list.html', context)
+        response = render(request, 'energy/partials/history_list.html', context)
+        # Con la generación leída antes de la consulta: si algo cambió en
+        # medio, la entrada ya nace inválida
+        cache.set(key, (gen, response.content), HISTORY_CACHE_TTL)
+        return response
     return render(request, 'energy/history.html', context)
\ No newline at end of file
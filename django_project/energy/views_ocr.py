@@ -11,28 +11,45 @@ Retorna JSON:
   { "ok": false, "error": "mensaje" }
 """
 
+import hashlib
 import os
-import json
+from functools import lru_cache
 
+from django.core.cache import cache
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
-from django.views.decorators.csrf import csrf_exempt  # HTMX envía CSRF por header; lo dejamos por si alguien testa con curl
 
 from .services.ocr import CFEVisionExtractor
 
 
+# Clave de OpenAI, leída una vez al importar (el entorno no cambia en vida
+# del worker)
+_API_KEY = os.environ.get("OPENAI_API_KEY")
+
 # Extensiones permitidas para la imagen
 _EXTENSIONES_OK = {".jpg", ".jpeg", ".png"}
 
 # Tamaño máximo: 5 MB
 _MAX_SIZE_BYTES = 5 * 1024 * 1024
 
+# Resultados de OCR por hash del archivo: 30 días
+_OCR_CACHE_TTL = 30 * 24 * 60 * 60
+
+# Firmas (magic bytes) de los formatos aceptados
+_FIRMAS = {
+    b"\xff\xd8\xff": "image/jpeg",
+    b"\x89PNG\r\n\x1a\n": "image/png",
+}
+
 
 @require_POST
-def extract_bill(request):
+async def extract_bill(request):
     """
     Endpoint HTMX: recibe una imagen, la envía a OpenAI y retorna
     los campos extraídos como JSON para pre-rellenar el formulario.
+
+    Es async para que la espera de la API de visión (varios segundos)
+    no bloquee el worker cuando se sirve con ASGI.
     """
     # --- Validar archivo ---
     archivo = request.FILES.get("evidencia_archivo")
@@ -52,28 +69,53 @@ def extract_bill(request):
             status=400,
         )
 
+    # El contenido debe coincidir con la extensión: rechazar aquí en vez de
+    # pagar una llamada a OpenAI que va a fallar
+    mime = "image/jpeg" if ext in (".jpg", ".jpeg") else "image/png"
+    cabecera = archivo.read(8)
+    archivo.seek(0)
+    if not any(cabecera.startswith(firma) and tipo == mime for firma, tipo in _FIRMAS.items()):
+        return JsonResponse(
+            {"ok": False, "error": "El archivo no es una imagen JPG o PNG válida."},
+            status=400,
+        )
+
     # --- Llamar al extractor ---
-    api_key = _get_api_key()
-    if not api_key:
+    if not _API_KEY:
         return JsonResponse(
             {"ok": False, "error": "OCR no configurado (falta OPENAI_API_KEY)."},
             status=503,
         )
 
-    mime = "image/jpeg" if ext in (".jpg", ".jpeg") else "image/png"
+    # Misma imagen (reintentos, fotos de demo) → mismo resultado, sin volver
+    # a pagar la llamada de visión
+    cache_key = _ocr_cache_key(archivo)
+    datos = await cache.aget(cache_key)
+    if datos is not None:
+        return JsonResponse({"ok": True, "data": datos})
 
     try:
-        extractor = CFEVisionExtractor(api_key=api_key)
-        datos = extractor.extract_from_bytes(archivo.read(), mime=mime)
+        extractor = _get_extractor(_API_KEY)
+        datos = await extractor.extract_from_file_async(archivo.file, mime=mime)
     except Exception as exc:  # pragma: no cover
         return JsonResponse(
             {"ok": False, "error": f"Error al procesar imagen: {str(exc)}"},
             status=500,
         )
-    print(datos)
+    await cache.aset(cache_key, datos, _OCR_CACHE_TTL)
     return JsonResponse({"ok": True, "data": datos})
 
 
-def _get_api_key() -> str | None:
-    """Obtiene la clave de OpenAI de variables de entorno."""
-    return os.environ.get("OPENAI_API_KEY")
\ No newline at end of file
+def _ocr_cache_key(archivo) -> str:
+    """Clave de cache por contenido (blake2b por bloques; deja el archivo al inicio)."""
+    h = hashlib.blake2b(digest_size=16)
+    for bloque in archivo.chunks():
+        h.update(bloque)
+    archivo.seek(0)
+    return f"ocr:{h.hexdigest()}"
+
+
+@lru_cache(maxsize=1)
+def _get_extractor(api_key: str) -> CFEVisionExtractor:
+    """Un extractor por proceso: reusa sus clientes de OpenAI entre requests."""
+    return CFEVisionExtractor(api_key=api_key)